@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Converts many images with the same printer options, spread over a pool
+of worker processes. Results are written in input order, either as one
+stream or as one file per input.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import columnFormat
+import jobcache
+import sys
+import os
+
+def _convert(job):
+    path, left_offset, options, cache = job
+    if cache:
+        im = Image.open(path)
+        key = cache.key(im, left_offset, options)
+        result = cache.get(key)
+        if result:
+            return result
+        result = columnFormat._encoder(**options).encode(columnFormat._pad(im, left_offset))
+        cache.put(key, *result)
+        return result
+    im = columnFormat._open_image(path, left_offset)
+    return columnFormat._encoder(**options).encode(im)
+
+def _read_manifest(path):
+    # one input per line, blank lines and # comments are skipped
+    fp = sys.stdin if path == '-' else open(path)
+    with fp:
+        return [line.strip() for line in fp if line.strip() and not line.startswith('#')]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Process many images for escp printer.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', nargs='*',
+                    help='input images')
+    parser.add_argument('-M', '--manifest',
+                    help='file listing input images, one per line (- for stdin)')
+    parser.add_argument('-O', '--output', default='-',
+                    help='output file of the concatenated stream (dafaults to stdout)')
+    parser.add_argument('-S', '--split',
+                    help='write one file per input instead, e.g. "out/{index}_{name}.prn"')
+    parser.add_argument('-j', '--jobs', default=os.cpu_count(), type=int,
+                    help='number of worker processes')
+    columnFormat._add_arguments(parser)
+    columnFormat._add_cache_arguments(parser)
+
+    args = parser.parse_args()
+
+    inputs = list(args.input)
+    if args.manifest:
+        inputs += _read_manifest(args.manifest)
+    if not inputs:
+        parser.error('no input images')
+
+    options = columnFormat._encoding_options(args)
+    init = columnFormat._printer_init(args.printer, args.paper_width)
+    cache = jobcache.JobCache(args.cache, args.cache_size << 20) if args.cache else None
+    jobs = [(path, args.left_offset, options, cache) for path in inputs]
+
+    if not args.split:
+        if args.output == '-':
+            fp=os.fdopen(sys.stdout.fileno(), 'wb')
+        else:
+            fp=open(args.output,'wb')
+        fp.write(init)
+
+    with ProcessPoolExecutor(args.jobs) as pool:
+        # map hands results back in input order
+        for index, (path, (blob, lines)) in enumerate(zip(inputs, pool.map(_convert, jobs))):
+            if args.split:
+                name = os.path.splitext(os.path.basename(path))[0]
+                with open(args.split.format(index=index, name=name),'wb') as out:
+                    out.write(init)
+                    out.write(blob * args.count)
+            else:
+                fp.write(blob * args.count)
+                fp.flush()
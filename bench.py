@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Benchmark and golden output check of the column format encoder.
+
+Every case encodes a synthetic image with one combination of printer,
+mode, overscan and colour. The throughput and peak memory are reported,
+and the sha256 of the output is compared with golden.json so that
+changes to _to_column_format can be checked for exact equivalence.
+The images are also read in strips as raw PGM/PPM files of other maxvals,
+with a band local dither the output must equal the whole image one.
+
+--roundtrip feeds every output to the virtual printer and compares the
+printed dots with the dithered planes, for cases whose overscan passes
+interleave on the pins. It also prints every glyph of the ROM fonts in
+character mode and compares the page with fontrenderer.render.
+
+--startup times whole runs of the rastertoescp print filter on a small
+page, the per job latency of a print server, and checks that its output
+equals columnFormat.py reading the same image in strips.
+"""
+
+from PIL import Image
+import numpy as np
+import columnFormat
+import virtualprinter
+import fontrenderer
+import romfont
+import tracemalloc
+import subprocess
+import tempfile
+import hashlib
+import struct
+import json
+import time
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN = os.path.join(HERE, 'golden.json')
+
+PRINTERS = (("9pin",5), ("9pin",1), ("24pin",39), ("24pin",1), ("lq510",39), ("oki",1), ("escpos",33))
+
+# Variants on top of the plain encoder, all exact byte streams too
+OPTIONS = {
+        '': {},
+        'elide': dict(elide=True),
+        'trim': dict(elide=True, trim=True, cut=True),
+        'raster': dict(raster=True),
+        'schedule': dict(schedule=True),
+        'bayer': dict(dither='bayer'),
+        'bluenoise': dict(dither='bluenoise'),
+        'band': dict(dither='band'),
+        }
+
+def _images(scale=1):
+    # Synthetic test images, deterministic for a given scale
+    rs = np.random.RandomState(2135)
+    width, height = 96*scale, 120*scale
+    images = {}
+    images['blank'] = Image.new("RGB", (width, height), '#fff')
+    images['solid'] = Image.new("RGB", (width, height), (40, 90, 200))
+
+    # text-like: rows of random glyph boxes of 1 dot strokes
+    text = np.full((height, width), 255, np.uint8)
+    for top in range(4, height-12, 14):
+        for left in range(4, width-8, 8):
+            if rs.rand() < 0.8:
+                glyph = rs.rand(10, 6) < 0.35
+                text[top:top+10, left:left+6][glyph] = 0
+    images['text'] = Image.fromarray(text, "L").convert("RGB")
+
+    # photo: smooth colour gradients with noise
+    y, x = np.mgrid[0:height, 0:width]
+    photo = np.stack([128 + 127*np.sin(x/(7*scale)),
+            128 + 127*np.cos(y/(11*scale)),
+            255*(x+y)/(width+height)], axis=2)
+    photo += rs.normal(0, 12, photo.shape)
+    images['photo'] = Image.fromarray(np.clip(photo, 0, 255).astype(np.uint8), "RGB")
+
+    # banner: long and mostly white with a few printed blocks
+    banner = np.full((height*8, width, 3), 255, np.uint8)
+    for top in range(0, height*8, height):
+        banner[top+height//4:top+height//2, width//8:width//2] = rs.randint(0, 256, 3)
+    images['banner'] = Image.fromarray(banner, "RGB")
+    return images
+
+def _cases(images):
+    for name in images:
+        for printer, mode in PRINTERS:
+            for overscan in (1, 2, 3):
+                for colour in ('k', 'rk', 'cmyk'):
+                    for variant, options in OPTIONS.items():
+                        if variant == 'raster' and (columnFormat._profile(printer)['raster'] is None or columnFormat._mode_width(mode) != 3):
+                            continue
+                        key = "/".join(str(v) for v in (name, printer, mode, overscan, colour, variant) if v != '')
+                        yield key, name, dict(options, printer=printer, mode=mode, overscan=overscan, skip=1, colour=colour)
+
+def _pwg(im, dpi=180):
+    # PWG raster of an RGB image, every line as literal runs
+    header = bytearray(1796)
+    header[0:9] = b"PwgRaster"
+    struct.pack_into(">II", header, 276, dpi, dpi)
+    width, height = im.size
+    for offset, value in ((372, width), (376, height), (384, 8), (388, 24), (392, width*3), (400, 19), (420, 3)):
+        struct.pack_into(">I", header, offset, value)
+    data = bytearray(b"RaS2" + header)
+    pixels = np.asarray(im.convert("RGB"))
+    for line in pixels:
+        data.append(0)
+        for left in range(0, width, 128):
+            run = line[left:left+128]
+            data.append(257 - len(run) if len(run) > 1 else 0)
+            data += run.tobytes()
+    return bytes(data)
+
+def _startup(images, runs, options="printer=24pin mode=39 overscan=2 colour=cmyk elide"):
+    # Wall time of whole filter runs in seconds, and whether their output is the one of
+    # columnFormat.py in strips of the same size
+    im = images['text']
+    raster = _pwg(im)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.join(HERE, 'rastertoescp.py'), '1', 'bench', 'startup', '1', options],
+                input=raster, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        times.append(time.perf_counter() - start)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'text.png')
+        im.save(path)
+        start = time.perf_counter()
+        expected = subprocess.run([sys.executable, os.path.join(HERE, 'columnFormat.py'),
+                '-p', '24pin', '-m', '39', '-o', '2', '-c', 'cmyk', '-e', '-b', '4', path],
+                stdout=subprocess.PIPE, check=True).stdout
+        cli = time.perf_counter() - start
+    return sorted(times), cli, out == expected
+
+def _roundtrip(im, options, blob):
+    # Whether the virtual printer prints the planes of the separation stage from blob,
+    # None when overscan passes do not land on the rows between the pins (printers with a
+    # fixed feed per pass, lq510 and oki)
+    printer = virtualprinter.VirtualPrinter(options['printer'])
+    profile = printer.profile
+    pins = profile['pins'].get(columnFormat._mode_width(options['mode']))
+    if (pins is None or profile.get('pass_feed') or printer.dpi // pins != options['overscan']
+            or options['skip'] * printer.dpi != profile['unit']):
+        return None
+    printer.write(blob)
+    printer.close()
+    planes = columnFormat._separate_image(im, options['colour'], dither=options.get('dither'),
+            band=options['overscan']*columnFormat._mode_width(options['mode'])*8)
+    for col in columnFormat._colours[options['colour']]:
+        expected = np.asarray(planes[col]).T
+        dots = printer.bitmap(col) if col in printer.colours() else np.zeros((0, 0), bool)
+        shape = np.maximum(expected.shape, dots.shape)
+        if not np.array_equal(np.pad(expected, [(0, n - m) for n, m in zip(shape, expected.shape)]),
+                np.pad(dots, [(0, n - m) for n, m in zip(shape, dots.shape)])):
+            return False
+    return True
+
+def _strips(im, magic, maxval, options):
+    # Whether the strip path reading im as a raw PNM file of maxval gives the output of
+    # the whole image decoded by PIL
+    pixels = np.asarray(im.convert("RGB" if magic == b"P6" else "L")).astype(np.uint16) * maxval // 255
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'image.pnm')
+        with open(path, 'wb') as fp:
+            fp.write(b"%s\n%d %d\n%d\n" % (magic, im.size[0], im.size[1], maxval))
+            fp.write(pixels.astype(np.uint8).tobytes())
+        rows = options['overscan'] * columnFormat._mode_width(options['mode']) * 8
+        image = []
+        lines = columnFormat._write_stream(columnFormat._iter_strip_format(*columnFormat._read_strips(path, rows), **options), image.append)
+        with Image.open(path) as whole:
+            return (b"".join(image), lines) == columnFormat._to_column_format(whole, **options)
+
+def _text_roundtrip(printer, font):
+    # Whether the character mode text of every glyph of font prints as render draws it.
+    # Cells are 1/10 inch of 120 dpi columns, the columns right of narrower glyphs stay white.
+    glyphs, index = fontrenderer.atlas(font)
+    chars = "".join(sorted(index))
+    text = [chars[i:i+40] for i in range(0, len(chars), 40)] + ["", "╔══╗ text", "╚══╝"]
+    printer = virtualprinter.VirtualPrinter(printer, font)
+    printer.write(columnFormat._printer_init(printer.printer) + fontrenderer.to_text_mode(text, font, printer.printer))
+    printer.close()
+    expected = ~np.asarray(fontrenderer.render(text, font))
+    height, width = printer.profile['cell']
+    dots = printer.bitmap(0)[::printer.dpi // printer.profile['pins'][height // 8]]
+    columns = max(len(line) for line in text)
+    if len(dots) > len(expected) or dots.shape[1] > columns*12:
+        return False
+    cells = np.pad(dots, ((0, len(expected) - len(dots)), (0, columns*12 - dots.shape[1]))).reshape(len(expected), columns, 12)
+    return not cells[:, :, width:].any() and np.array_equal(cells[:, :, :width].reshape(expected.shape), expected)
+
+def _run(im, options, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        blob, lines = columnFormat._to_column_format(im, **options)
+    elapsed = (time.perf_counter() - start) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return blob, lines, elapsed, peak
+
+if __name__ == "__main__":
+    import argparse
+    import fnmatch
+    parser = argparse.ArgumentParser(description='Benchmark column format encoder and check its output.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-k', '--filter', default='*',
+                    help='only cases matching this pattern, e.g. "photo/24pin/*"')
+    parser.add_argument('-x', '--scale', default=1, type=int,
+                    help='multiply image sizes (golden check only at 1)')
+    parser.add_argument('-r', '--repeat', default=1, type=int,
+                    help='encode every case that many times')
+    parser.add_argument('-u', '--update', action="store_true",
+                    help='write current output digests to golden.json')
+    parser.add_argument('-q', '--quiet', action="store_true",
+                    help='only report mismatches and totals')
+    parser.add_argument('-R', '--roundtrip', action="store_true",
+                    help='check the printed dots of every output with the virtual printer')
+    parser.add_argument('-S', '--startup', default=0, type=int,
+                    help='time that many print filter runs instead of the encoder cases')
+    parser.add_argument('--startup-limit', default=400, type=int,
+                    help='fail when the median print filter run takes longer (ms)')
+    args = parser.parse_args()
+
+    if args.startup:
+        times, cli, same = _startup(_images(), args.startup)
+        median = times[len(times)//2]
+        print("filter min %.1f ms median %.1f ms, columnFormat.py %.1f ms" % (times[0]*1e3, median*1e3, cli*1e3))
+        if not same:
+            sys.exit("filter output differs from columnFormat.py")
+        if median*1e3 > args.startup_limit:
+            sys.exit("filter median %.1f ms over the %d ms limit" % (median*1e3, args.startup_limit))
+        sys.exit()
+
+    golden = {}
+    if os.path.exists(GOLDEN):
+        with open(GOLDEN) as fp:
+            golden = json.load(fp)
+    check = args.scale == 1 and not args.update
+
+    images = _images(args.scale)
+    failed = 0
+    total_pixels = total_bytes = total_time = 0
+    if not args.quiet:
+        print("%-40s %10s %10s %9s %9s" % ("case", "Mpixel/s", "MB/s", "peak MB", "bytes"))
+    for key, name, options in _cases(images):
+        if not fnmatch.fnmatch(key, args.filter):
+            continue
+        im = images[name]
+        blob, lines, elapsed, peak = _run(im, options, args.repeat)
+        pixels = im.size[0] * im.size[1]
+        total_pixels += pixels
+        total_bytes += len(blob)
+        total_time += elapsed
+        if not args.quiet:
+            print("%-40s %10.2f %10.2f %9.1f %9d" % (key, pixels/elapsed/1e6, len(blob)/elapsed/1e6, peak/1e6, len(blob)))
+
+        if args.roundtrip and _roundtrip(im, options, blob) is False:
+            failed += 1
+            print("ROUNDTRIP %s: printed dots differ from the planes" % key, file=sys.stderr)
+
+        result = {'sha256': hashlib.sha256(blob).hexdigest(), 'lines': lines, 'bytes': len(blob)}
+        if args.update:
+            golden[key] = result
+        elif check and golden.get(key) != result:
+            failed += 1
+            print("MISMATCH %s: %s, expected %s" % (key, result, golden.get(key)), file=sys.stderr)
+
+    for name in images:
+        for magic in (b"P5", b"P6"):
+            for maxval in (100, 200):
+                key = "pnm/%s/%s/%d" % (name, magic.decode(), maxval)
+                if fnmatch.fnmatch(key, args.filter) and not _strips(images[name], magic, maxval,
+                        dict(printer="24pin", mode=39, overscan=2, colour='cmyk', dither='bayer')):
+                    failed += 1
+                    print("STRIPS %s: output differs from the whole image" % key, file=sys.stderr)
+
+    if args.roundtrip:
+        # character mode of the printers whose cell fits a ROM font
+        with open(romfont.TABLES) as fp:
+            fonts = json.load(fp)
+        with tempfile.TemporaryDirectory() as tmp:
+            for font in fonts:
+                path = os.path.join(tmp, font + '.font')
+                romfont.save(romfont.extract(fonts[font]), path)
+                for printer, profile in columnFormat._profiles().items():
+                    key = "font/%s/%s" % (font, printer)
+                    if profile.get('cell') != [fonts[font]['height'], fonts[font]['width']] or not fnmatch.fnmatch(key, args.filter):
+                        continue
+                    if not _text_roundtrip(printer, path):
+                        failed += 1
+                        print("ROUNDTRIP %s: printed text differs from render" % key, file=sys.stderr)
+
+    if total_time:
+        print("total %.2f Mpixel/s %.2f MB/s in %.2f s" % (total_pixels/total_time/1e6, total_bytes/total_time/1e6, total_time))
+    if args.update:
+        with open(GOLDEN, 'w') as fp:
+            json.dump(golden, fp, indent=1, sort_keys=True)
+    if failed:
+        sys.exit("%d cases differ from golden output" % failed)
@@ -9,168 +9,734 @@ PIL, rather than spend CPU cycles looping over pixels.
 Do not attempt to use this snippet in production, get a copy of python-escpos instead!
 """
 
-from PIL import Image, ImageOps
-import bitstring
+from PIL import Image
+import numpy as np
+import contextlib
+import functools
+import itertools
+import hashlib
+import json
+import jobcache
 import struct
+import shutil
+import math
+import time
 import sys
 import os
 
 ESC = b"\x1b";
 
-def _to_column_format(im,colour='cmyk',overscan=2,mode=39,printer="24pin",skip=1,cut=False):
+# Printer profiles: commands, paper feed, graphics modes and mechanics of each printer model
+PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'printers.json')
 
-    # Convert image to RGB type so we can process colours
-    im = im.convert("RGB")
-    # Initial rotate. mirror
-    im = im.transpose(Image.ROTATE_270).transpose(Image.FLIP_LEFT_RIGHT)
-    ci = Image.new("L",im.size,0)
-    mi = Image.new("L",im.size,0)
-    yi = Image.new("L",im.size,0)
-    ki = Image.new("L",im.size,0)
+def _command(text):
+    # Commands are kept in the profiles as strings of latin-1 characters, e.g. "\u001b*"
+    return None if text is None else text.encode('latin-1')
 
-    # Height and width refer to output size here, image is rotated in memory so coordinates are swapped
-    width_pixels, height_pixels = im.size
-    if colour == 'cmyk':
-        for y in range(0,height_pixels):
-            for x in range(0,width_pixels):
-                box=(x,y,x+1,y+1)
-                r,g,b=im.getpixel((x, y))
-                rp=r/255
-                gp=g/255
-                bp=b/255
-                k=1-max(rp,gp,bp)
-                c=(1-rp-k)/(1-k) if k!=1 else 0
-                m=(1-gp-k)/(1-k) if k!=1 else 0
-                yc=(1-bp-k)/(1-k) if k!=1 else 0
-                ki.paste((int(k*255)),box)
-                ci.paste((int(c*255)),box)
-                mi.paste((int(m*255)),box)
-                yi.paste((int(yc*255)),box)
-        ki=ki.convert("1")
-        ci=ci.convert("1")
-        mi=mi.convert("1")
-        yi=yi.convert("1")
-    elif colour == 'k':
-        # Convert to black & white via greyscale (so that bits can be inverted)
-        ki = im.convert("L")  # Invert: Only works on 'L' images
-        ki = ImageOps.invert(ki) # Bits are sent with 0 = white, 1 = black in ESC/POS
-        ki = ki.convert("1") # Pure black and white
-    elif colour == 'rk':
-        for y in range(0,height_pixels):
-            for x in range(0,width_pixels):
-                box=(x,y,x+1,y+1)
-                r,g,b=im.getpixel((x, y))
-                rp=r/255
-                gp=g/255
-                bp=b/255
-                k=1-max(rp,gp,bp)
-                w=min(rp,gp,bp)
-                m=(rp-w)/(1-k) if k!=1 else 0
-                ki.paste((int(k*255)),box)
-                mi.paste((int(m*255)),box)
-        ki=ki.convert("1")
-        mi=mi.convert("1")
-    else:
-        raise Exception("Not known colour mode")
+@functools.lru_cache()
+def _profiles(path=PROFILES):
+    # Profiles of path by printer name with their commands as bytes, read once per process.
+    # The digest of every profile keys cached jobs and templates encoded with it.
+    with open(path) as fp:
+        profiles = json.load(fp)
+    for profile in profiles.values():
+        profile['digest'] = hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+        for name in ('init', 'colour', 'position', 'graphics', 'raster', 'cut'):
+            profile[name] = _command(profile.get(name))
+        profile['feed'] = tuple(_command(text) for text in profile['feed'])
+        profile['mode_graphics'] = {int(mode): _command(text) for mode, text in profile.get('mode_graphics', {}).items()}
+        # horizontal dpi by supported mode, vertical pin dpi by bytes per column
+        profile['hdpi'] = {int(mode): dpi for mode, dpi in profile['hdpi'].items()}
+        profile['pins'] = {int(width): dpi for width, dpi in profile['pins'].items()}
+    return profiles
+
+def _profile(printer):
+    profiles = _profiles()
+    if printer not in profiles:
+        raise Exception('not known printer')
+    return profiles[printer]
+
+class _Stats:
+    # Stage timings, byte counts and head passes of a job, pass stats= to the encoder
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+        self.passes = [] # (colour, start column, columns, bytes) in print order
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_pass(self, col, start, columns, size):
+        self.passes.append((col, start, columns, size))
+
+    def merge(self, other):
+        if other:
+            for name, t in other.times.items():
+                self.times[name] = self.times.get(name, 0) + t
+            for name, n in other.counts.items():
+                self.count(name, n)
+            self.passes += other.passes
+
+class _NoStats:
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, n):
+        pass
+
+    def add_pass(self, col, start, columns, size):
+        pass
+
+    def merge(self, other):
+        pass
+
+_nostats = _NoStats()
 
-    mode_width = (6 if mode & 64 else (3 if mode & 32 else 1))
-    line_height = overscan *mode_width
-    top = 0
-    left = 0
+def _level(value):
+    # Same truncation as int(value*255) per pixel
+    return (value * 255).astype(np.int32).astype(np.uint8)
+
+def _feed(profile,linewidth):
+    # Paper feed command(s) for linewidth, split when it does not fit in one byte
+    before, after = profile['feed']
     image = b""
-    lines = 0 #in printer dpi
-    while left < width_pixels:
-        remaining_pixels = width_pixels - left
-        
-        if cut:
-            if left == (-(width_pixels+7+8)//8*8+10*8)%((width_pixels)//8*8+8):
-                image += ESC + b"i"
+    while True:
+        step = min(linewidth,255)
+        image += before + struct.pack("<B",step) + after
+        linewidth -= step
+        if linewidth <= 0:
+            return image
+
+def _trim(columns, hdpi):
+    # Drops white columns on both sides, the start is rounded down to a column ESC $ (1/60
+    # inch) can reach
+    ink = np.flatnonzero(columns.any(axis=1))
+    if not len(ink):
+        return columns, 0
+    step = hdpi // math.gcd(60, hdpi)
+    start = ink[0] // step * step
+    return columns[start:ink[-1]+1], start
+
+def _rle(data):
+    # Run length compression of ESC . mode 1 (TIFF PackBits)
+    data = np.frombuffer(data, np.uint8)
+    edges = np.flatnonzero(np.diff(data)) + 1
+    image = bytearray()
+    literal = 0
+    for start, end in zip(np.r_[0, edges], np.r_[edges, len(data)]):
+        if end - start < 3:
+            continue
+        while literal < start:
+            n = min(start - literal, 128)
+            image += struct.pack("<B",n-1) + data[literal:literal+n].tobytes()
+            literal += n
+        while end - literal >= 2:
+            n = min(end - literal, 128)
+            image += struct.pack("<B",257-n) + data[literal:literal+1].tobytes()
+            literal += n
+    while literal < len(data):
+        n = min(len(data) - literal, 128)
+        image += struct.pack("<B",n-1) + data[literal:literal+n].tobytes()
+        literal += n
+    return bytes(image)
+
+def _raster(dots, hdpi):
+    # ESC . compressed raster graphics of one 24 pin pass, dots is (columns, pins)
+    rows = np.packbits(dots.T, axis=1)
+    image = ESC + b"." + struct.pack("<BBBBH",1,20,3600//hdpi,dots.shape[1],dots.shape[0])
+    for row in rows:
+        image += _rle(row.tobytes())
+    return image
+
+def _commands(profile, mode):
+    # Prefixes of the passes of a printer and mode: ribbon selection by ESC r colour (none
+    # for one ribbon printers) and the graphics command that the column count follows
+    select = {col: profile['colour'] + struct.pack("<B",col) for col in _colours['cmyk']} if profile['colour'] else {}
+    if mode in profile['mode_graphics']:
+        graphics = profile['mode_graphics'][mode]
+    else:
+        graphics = profile['graphics'] + struct.pack("<B",mode)
+    return select, graphics
+
+def _encode_bands(planes,lefts,colours,height_pixels,mode,overscan,profile,select,graphics,skip,cut_at,elide,trim,raster,schedule,stats=_nostats):
+    # Commands of the bands starting at lefts: bytes to send, int for paper feed, None ends a band
+    # and a list of (colour, start, columns, bytes) for the colour passes of one head position
+    line_height = overscan *_mode_width(mode)
+    hdpi = profile['hdpi'][mode]
+    ops = []
+    for left in lefts:
+        if left == cut_at:
+            ops.append(profile['cut'])
 
         for i in range(0,overscan):
             
-            if colour == 'cmyk':
-                colours =  (4,1,2,0)
-            elif colour == 'rk':
-                colours = (1,0)
-            elif colour == 'k':
-                colours = (0,)
+            passes = []
             for col in colours:
                 
-                switcher={
-                        4: yi,
-                        2: ci,
-                        1: mi,
-                        0: ki,
-                        }
                 #, and extract blobs for each 8 or 24-pixel row
-                box = (left + i, top, left + line_height*8 + i, top + height_pixels)
-                slice = switcher[col].transform((line_height*8, height_pixels), Image.EXTENT, box)
-                data = slice.tobytes()
+                with stats.stage('slice'):
+                    band = np.unpackbits(planes[col][:, left//8:left//8 + line_height + 1], axis=1)
+                    data = band[:, :line_height*8]
             
-                assert len(data) % line_height == 0
-                assert len(data) == height_pixels * line_height
+                assert data.size % (line_height*8) == 0
+                assert data.size == height_pixels * line_height * 8
+
+                # every overscan-th bit of this pass, packed back to mode_width bytes per column
+                with stats.stage('repack'):
+                    dots = band[:, i:i + line_height*8:overscan]
+                    columns = np.packbits(dots, axis=1)
+
+                assert columns.size == data.size//8//overscan
 
-                if printer == "oki":
-                    image += ESC + struct.pack("<BH",b"KLYZ"[mode],len(data)//(line_height))
+                if (elide or schedule) and not columns.any():
+                    continue
+
+                image = bytearray(select.get(col, b""))
+                start = 0
+                if trim:
+                    columns, start = _trim(columns, hdpi)
+                    if start:
+                        image += profile['position'] + struct.pack("<H",start*60//hdpi)
+                if raster:
+                    with stats.stage('repack'):
+                        image += _raster(dots[start:start+len(columns)], hdpi)
                 else:
-                    image += ESC + b"r" + struct.pack("<B",col)
                     # Generate ESC/POS header
-                    image += ESC + b"*" + struct.pack("<BH",mode,len(data)//(line_height))
-
-                ai = 0
-                for j in range(0, len(data), line_height):
-                    value = bitstring.Bits(data[j:j+mode_width*overscan]).uintbe
-                    sparse = value
-                    byte = 0x00
-                    for k in range(0, mode_width*8):
-                        #100100100100100100100100
-                        byte |= ((1 << (overscan * k + overscan - 1)) & sparse) >> (overscan * k - k + overscan - 1 )
-                    ai+=mode_width
-                    image += bitstring.Bits(uintbe=byte, length=mode_width*8).tobytes()
-                    
+                    image += graphics + struct.pack("<H",len(columns))
+                    image += columns.tobytes()
                 image += b"\r"
-
-                assert ai == len(data)//overscan
+                passes.append((col, start, len(columns), bytes(image)))
+            if passes:
+                ops.append(passes)
 
             if i < overscan-1:
                 linewidth=skip
             else:
-                linedpi={"24pin":6,"lq510":3,"oki":3,"9pin":3,"escpos":2}[printer]
-                linewidth = linedpi*8-(overscan-1)*skip
-
-            if printer == "24pin":
-                image += ESC + b"+" + struct.pack("<B",linewidth) + b"\n"
-            elif printer == "lq510":
-                image += b"\r" + ESC + b"J" + struct.pack("<B",24)
-            elif printer == "9pin":
-                image += ESC + b"J" + struct.pack("<B",linewidth) + b"\r"
-            elif printer == "oki":
-                image += b"\r" + ESC + b"J" + struct.pack("<B",24)
-            elif printer == "escpos":
-                image += ESC + b"3" + struct.pack("<B",linewidth) + b"\n"
+                linewidth = profile['linedpi']*8-(overscan-1)*skip
+
+            # some printers (lq510, oki) always move by the same amount per pass
+            ops.append(profile.get('pass_feed') or linewidth)
+        ops.append(None)
+    return ops
+
+def _schedule(passes, last):
+    # Colour order of one head position: the fixed order or its reverse, whichever starts
+    # with the ribbon colour already selected, so adjacent bands share a colour
+    if passes[0][0] != last and passes[-1][0] == last:
+        return passes[::-1]
+    return passes
+
+def _assemble(ops, profile, schedule=False, stats=_nostats):
+    # Joins band commands into chunks, one per band. Consecutive paper feeds are merged
+    # into one move, sent just before the next data
+    image = bytearray()
+    feed = None
+    last = None # ribbon colour selected by the last pass
+    select = profile['colour']
+    for op in ops:
+        if op is None:
+            yield bytes(image)
+            image = bytearray()
+        elif isinstance(op, int):
+            feed = (feed or 0) + op
+        else:
+            if feed is not None:
+                image += _feed(profile,feed)
+                feed = None
+            if isinstance(op, list):
+                for col, start, columns, data in (_schedule(op, last) if schedule else op):
+                    if schedule and select and col == last and data.startswith(select):
+                        # ribbon already there
+                        data = data[len(select)+1:]
+                    image += data
+                    last = col
+                    stats.add_pass(col, start, columns, len(data))
             else:
-                raise Exception('not known printer')
-            lines +=linewidth
+                image += op
+    if feed is not None:
+        image += _feed(profile,feed)
+    if image:
+        yield bytes(image)
 
-        left += line_height*8
-    if cut:
-        image +=b"\r\n"
+_worker = None
 
-    return image, lines
+def _init_worker(planes, options, engines, timed):
+    global _worker
+    _worker = (planes, options, engines, timed)
 
-if __name__ == "__main__":
-    import argparse
-    parser = argparse.ArgumentParser(description='Process image for escp printer.',
-            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('input',
-                    help='input image')
-    parser.add_argument('output', default='-', nargs='?',
-                    help='output file (dafaults to stdout)')
+def _encode_range(lefts):
+    # ops of the bands and the stats of this range when timed
+    planes, options, engines, timed = _worker
+    stats = _Stats() if timed else _nostats
+    if engines:
+        return _encode_levels(planes, lefts, engines, options, stats), stats if timed else None
+    return _encode_bands(planes, lefts, stats=stats, **options), stats if timed else None
+
+def _encode_levels(levels, lefts, engines, options, stats=_nostats):
+    # _encode_bands of ink levels dithered with band local engines for just these bands
+    band = options['overscan'] * _mode_width(options['mode']) * 8
+    start, stop = lefts[0], lefts[-1] + band
+    planes = _pack(_dither({col: level[:, start:stop] for col, level in levels.items()}, stats, engines, band, start),
+            band // 8, stats)
+    cut_at = options['cut_at'] - start if options['cut_at'] is not None else None
+    return _encode_bands(planes, range(0, stop - start, band), stats=stats, **dict(options, cut_at=cut_at))
+
+_colours = {'cmyk': (4,1,2,0), 'rk': (1,0), 'k': (0,)}
+
+def _levels(rgb, colour):
+    # Ink levels of RGB values (an array of any shape ending in 3), keyed by ESC r colour
+    if colour == 'cmyk':
+        rgb = rgb / 255
+        k = 1 - rgb.max(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cmy = (1 - rgb - k[..., None]) / (1 - k[..., None])
+        cmy[k == 1] = 0
+        return {4: _level(cmy[..., 2]), 1: _level(cmy[..., 1]), 2: _level(cmy[..., 0]), 0: _level(k)}
+    elif colour == 'k':
+        # Convert to black & white via greyscale (so that bits can be inverted)
+        ki = np.asarray(Image.fromarray(rgb.reshape(-1, 1, 3), "RGB").convert("L"))
+        # Invert: bits are sent with 0 = white, 1 = black in ESC/POS
+        return {0: 255 - ki.reshape(rgb.shape[:-1])}
+    elif colour == 'rk':
+        rgb = rgb / 255
+        k = 1 - rgb.max(axis=-1)
+        w = rgb.min(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = (rgb[..., 0] - w) / (1 - k)
+        m[k == 1] = 0
+        return {1: _level(m), 0: _level(k)}
+    else:
+        raise Exception("Not known colour mode")
+
+def _bayer(n=8):
+    # Ordered dither matrix, ranks 0 to n*n-1
+    rank = np.zeros((1, 1), np.int32)
+    while len(rank) < n:
+        rank = np.block([[4*rank, 4*rank + 2], [4*rank + 3, 4*rank + 1]])
+    return rank
+
+@functools.lru_cache()
+def _blue_noise(n=64, sigma=1.5):
+    # Void and cluster matrix, ranks 0 to n*n-1: the dots of every level are spread evenly
+    rs = np.random.RandomState(2135)
+    d = np.minimum(np.arange(n), n - np.arange(n))
+    kernel = np.exp(-(d[:, None]**2 + d[None, :]**2) / (2*sigma**2))
+    def energy(pattern):
+        return np.real(np.fft.ifft2(np.fft.fft2(pattern) * np.fft.fft2(kernel)))
+    def splat(e, i, sign):
+        e += sign * np.roll(kernel, divmod(i, n), axis=(0, 1))
+
+    # initial pattern, tightest cluster moved to the largest void until it stays
+    pattern = rs.rand(n, n) < 0.1
+    e = energy(pattern)
+    while True:
+        cluster = np.argmax(np.where(pattern, e, -np.inf))
+        pattern.flat[cluster] = False
+        splat(e, cluster, -1)
+        void = np.argmin(np.where(pattern, np.inf, e))
+        pattern.flat[void] = True
+        splat(e, void, 1)
+        if void == cluster:
+            break
+
+    rank = np.zeros((n, n), np.int32)
+    ones = np.count_nonzero(pattern)
+    # lower ranks: remove the tightest clusters of the initial pattern
+    p, e = pattern.copy(), energy(pattern)
+    for r in range(ones - 1, -1, -1):
+        i = np.argmax(np.where(p, e, -np.inf))
+        p.flat[i] = False
+        splat(e, i, -1)
+        rank.flat[i] = r
+    # higher ranks: fill the largest voids
+    p, e = pattern.copy(), energy(pattern)
+    for r in range(ones, n*n):
+        i = np.argmin(np.where(p, np.inf, e))
+        p.flat[i] = True
+        splat(e, i, 1)
+        rank.flat[i] = r
+    return rank
+
+def _ordered(level, rank, top):
+    # Ink where the level is over the threshold of the rank matrix, tiled from the image
+    # origin so that any band or strip gives the same dots as the whole image
+    n = len(rank)
+    thresholds = (255 * (2*rank + 1) // (2*rank.size)).astype(np.uint8)
+    rows, columns = np.shape(level)
+    return level > thresholds[np.arange(rows)[:, None] % n, (np.arange(columns) + top)[None, :] % n]
+
+def _diffuse(level, band):
+    # Floyd-Steinberg error diffusion that stops at every band border
+    return np.concatenate([np.asarray(Image.fromarray(level[:, left:left+band], "L").convert("1"))
+            for left in range(0, np.shape(level)[1], band)], axis=1)
+
+# Dithering engines: fs diffuses the error over the whole image, the others only depend
+# on the position of a pixel or on its own band, so bands can be dithered independently
+_dithers = {
+        'fs': lambda level, band, top: Image.fromarray(level, "L").convert("1"),
+        'bayer': lambda level, band, top: _ordered(level, _bayer(), top),
+        'bluenoise': lambda level, band, top: _ordered(level, _blue_noise(), top),
+        'band': lambda level, band, top: _diffuse(level, band),
+        }
+
+# Plane names of the --dither option
+_plane_names = {'k': 0, 'm': 1, 'r': 1, 'c': 2, 'y': 4}
+
+def _parse_dither(spec, colour):
+    # Engine per ESC r colour from "engine" or "engine,plane=engine,...", e.g. "bayer,k=band"
+    engines = {col: 'fs' for col in _colours[colour]}
+    for item in (spec or 'fs').split(','):
+        name, _, engine = item.rpartition('=')
+        if engine not in _dithers:
+            raise Exception("Not known dither engine %s" % engine)
+        if not name:
+            engines = {col: engine for col in engines}
+        elif name in _plane_names:
+            engines[_plane_names[name]] = engine
+        else:
+            raise Exception("Not known plane %s" % name)
+    return engines
+
+def _band_local(engines):
+    return all(engine != 'fs' for engine in engines.values())
+
+def _dither(levels, stats=_nostats, engines={}, band=None, top=0):
+    # Dithered planes of ink levels. The band engine keeps its error within band rows along
+    # the feed, top is the position of the levels in the image and a multiple of band.
+    with stats.stage('dither'):
+        return {col: _dithers[engines.get(col, 'fs')](level, band, top) for col, level in levels.items()}
+
+def _separate(rgb, colour, stats=_nostats, engines={}, band=None, top=0):
+    # Dithered planes of an RGB array, keyed by the ESC r colour they print with
+    with stats.stage('separate'):
+        levels = _levels(rgb, colour)
+    return _dither(levels, stats, engines, band, top)
+
+# Images with up to this many colours are separated through a table of their colours
+_MAX_COLOURS = 4096
+
+@functools.lru_cache(maxsize=32)
+def _lut(entries, colour):
+    # _levels of palette entries (RGB bytes), kept for the next jobs with the same colours
+    return _levels(np.frombuffer(entries, np.uint8).reshape(-1, 3), colour)
+
+def _lut_levels(im, colour):
+    # _levels of a palette image or an RGB image of few colours, evaluated once per colour
+    # and looked up per pixel; None for images of more colours
+    if im.mode == "P":
+        palette = bytes(im.getpalette("RGB"))
+        index = np.asarray(im)
+        # entries past the palette are black
+        palette += bytes(3*256 - len(palette))
+    else:
+        colours = im.getcolors(_MAX_COLOURS)
+        if colours is None:
+            return None
+        entries = np.array(sorted(c for n, c in colours), np.uint8)
+        rgb = np.asarray(im).astype(np.int32)
+        index = np.searchsorted(entries.astype(np.int32) @ (1 << 16, 1 << 8, 1),
+                (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2])
+        palette = entries.tobytes()
+    return {col: table[index] for col, table in _lut(palette, colour).items()}
+
+def _mode_width(mode):
+    return (6 if mode & 64 else (3 if mode & 32 else 1))
+
+def _pack(planes, line_height, stats=_nostats):
+    # One packed bit-plane per colour, rows are printer columns and bits run along the feed.
+    # Padding keeps the last band and its overscan passes inside the array (reads as white).
+    with stats.stage('pack'):
+        return {col: np.pad(np.packbits(np.asarray(plane), axis=1), ((0, 0), (0, line_height + 1)))
+                for col, plane in planes.items()}
+
+def _band_setup(colour,overscan,mode,printer,skip,elide,trim,raster,schedule):
+    # Checked keyword arguments of _encode_bands that do not depend on the image: the
+    # options, the printer profile and the pass commands of the mode
+    profile = _profile(printer)
+    if colour not in _colours:
+        raise Exception("Not known colour mode")
+    if mode not in profile['hdpi']:
+        raise Exception("mode %d is not supported by %s printer" % (mode, printer))
+    # printers without ESC $ (oki, escpos) can not move the head
+    trim = trim and profile['position'] is not None
+    if raster and (profile['raster'] is None or _mode_width(mode) != 3):
+        raise Exception("raster graphics need 24pin printer and 24 dot mode")
+    select, graphics = _commands(profile, mode)
+    return dict(colours=_colours[colour],
+            mode=mode,
+            overscan=overscan,
+            profile=profile,
+            select=select,
+            graphics=graphics,
+            skip=skip,
+            elide=elide,
+            trim=trim,
+            raster=raster,
+            schedule=schedule)
+
+def _band_options(width_pixels,height_pixels,setup,cut):
+    # Keyword arguments of _encode_bands for an image of width_pixels rows to feed
+    return dict(setup,
+            height_pixels=height_pixels,
+            cut_at=(-(width_pixels+7+8)//8*8+10*8)%((width_pixels)//8*8+8) if cut else None)
+
+def _lines(width_pixels, line_height, profile):
+    # in printer dpi, overscan passes add up to one band
+    return -(-width_pixels // (line_height*8)) * profile['linedpi']*8
+
+def _separate_image(im, colour='cmyk', stats=_nostats, dither=None, band=None):
+    # Separation stage: dithered planes of the rotated image keyed by ESC r colour.
+    # They do not depend on printer, mode or overscan and can be encoded for several targets,
+    # only the band dither engine keeps its error within band rows.
+    return _dither(_separate_levels(im, colour, stats), stats, _parse_dither(dither, colour), band)
+
+def _separate_levels(im, colour='cmyk', stats=_nostats):
+    # Ink levels of the rotated image keyed by ESC r colour
+
+    with stats.stage('rotate'):
+        if im.mode != "P":
+            # Convert image to RGB type so we can process colours
+            im = im.convert("RGB")
+        # Initial rotate. mirror
+        im = im.transpose(Image.ROTATE_270).transpose(Image.FLIP_LEFT_RIGHT)
+    with stats.stage('separate'):
+        if colour not in _colours:
+            raise Exception("Not known colour mode")
+        levels = _lut_levels(im, colour)
+        if levels is None:
+            levels = _levels(np.asarray(im), colour)
+    return levels
+
+def _iter_column_format(im,colour='cmyk',overscan=2,mode=39,*args,dither=None,engines=None,stats=_nostats,**kwargs):
+    # Yields the ESC/P commands band by band, the generator returns lines when exhausted
+    # dither picks the engine per plane, see _parse_dither, engines are dither parsed before
+    if engines is None:
+        engines = _parse_dither(dither, colour)
+    levels = _separate_levels(im, colour, stats)
+    if _band_local(engines):
+        # bands are dithered as they are encoded, by the workers when there are
+        return (yield from _iter_plane_format(levels, colour, overscan, mode, *args, engines=engines, stats=stats, **kwargs))
+    planes = _dither(levels, stats, engines, overscan*_mode_width(mode)*8)
+    return (yield from _iter_plane_format(planes, colour, overscan, mode, *args, stats=stats, **kwargs))
+
+def _band_digest(planes, start, stop):
+    # Hash of the columns start to stop of every plane, packed bits or ink levels of one band
+    h = hashlib.sha256()
+    for col, plane in sorted(planes.items()):
+        h.update(plane[:, start:stop].tobytes())
+    return h.digest()
+
+def _iter_plane_format(planes,colour='cmyk',overscan=2,mode=39,printer="24pin",skip=1,cut=False,elide=False,trim=False,raster=False,schedule=False,workers=0,engines=None,template=None,setup=None,stats=_nostats):
+    # Encoding stage of _iter_column_format for planes from _separate_image, or for ink
+    # levels from _separate_levels dithered range by range with band local engines
+    # elide skips passes without ink and merges their paper feed into the next one
+    # trim sends only the inked part of each pass and moves the head there with ESC $
+    # raster sends the same dots as ESC/P2 ESC . run length compressed graphics
+    # schedule drops colour passes without ink and orders colours to save ribbon shifts
+    # workers > 1 encodes ranges of bands in that many processes, output stays the same
+    # template (jobcache.Template) supplies the bands that did not change since its base image
+    # setup is _band_setup of these options made before, by an Encoder
+
+    # Height and width refer to output size here, image is rotated in memory so coordinates are swapped
+    height_pixels, width_pixels = np.shape(planes[0])
+    if setup is None:
+        setup = _band_setup(colour,overscan,mode,printer,skip,elide,trim,raster,schedule)
+    profile = setup['profile']
+    options = _band_options(width_pixels,height_pixels,setup,cut)
+    line_height = overscan *_mode_width(mode)
+    if not engines:
+        planes = _pack(planes, line_height, stats)
+    lefts = range(0, width_pixels, line_height*8)
+    lines = _lines(width_pixels, line_height, profile)
+
+    # Enter ESC/P2 graphics mode
+    head = [profile['raster']] if raster else []
+    tail = [b"\r\n"] if cut else []
+
+    if workers > 1 and template is None:
+        # a few ranges per worker so the first bands come back early
+        size = -(-len(lefts) // (workers*4))
+        timed = not isinstance(stats, _NoStats)
+        # imported here, it costs every short job (print filters) its start up time
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(planes, options, engines, timed)) as pool:
+            ranges = pool.map(_encode_range, [lefts[n:n+size] for n in range(0, len(lefts), size)])
+            def ops():
+                for chunk, chunk_stats in ranges:
+                    stats.merge(chunk_stats)
+                    yield from chunk
+            yield from _assemble(itertools.chain(head, ops(), tail), profile, schedule, stats)
+    else:
+        if engines:
+            encode = lambda left: _encode_levels(planes, [left], engines, options, stats)
+        else:
+            encode = lambda left: _encode_bands(planes, [left], stats=stats, **options)
+        band_ops = encode
+        if template is not None:
+            # the options hold the profile, with the digest of its entry in printers.json
+            template.check(dict(options, engines=engines))
+            # levels are not packed yet, packed planes have 8 columns to the byte
+            scale = 1 if engines else 8
+            def band_ops(left):
+                with stats.stage('digest'):
+                    digest = _band_digest(planes, left//scale, (left + line_height*8)//scale)
+                return template.ops(left, digest, lambda: encode(left))
+        ops = (op for left in lefts for op in band_ops(left))
+        yield from _assemble(itertools.chain(head, ops, tail), profile, schedule, stats)
+
+    return lines
+
+def _iter_strip_format(strips,width_pixels,colour='cmyk',overscan=2,mode=39,printer="24pin",skip=1,cut=False,elide=False,trim=False,raster=False,schedule=False,dither=None,stats=_nostats):
+    # _iter_column_format for an image given as RGB strips of rows in file order, width_pixels
+    # rows in total. All strips but the last must be a multiple of the band height.
+    # Every strip is separated and dithered on its own, so memory follows the strip size
+    # and not the image length. fs error diffusion does not cross strip borders, the band
+    # local engines give the same output as the whole image.
+    strips = iter(strips)
+    strip = next(strips)
+    height_pixels = strip.shape[1]
+    setup = _band_setup(colour,overscan,mode,printer,skip,elide,trim,raster,schedule)
+    profile = setup['profile']
+    options = _band_options(width_pixels,height_pixels,setup,cut)
+    line_height = overscan *_mode_width(mode)
+    lines = _lines(width_pixels, line_height, profile)
+    engines = _parse_dither(dither, colour)
+
+    def ops(strip):
+        top = 0
+        for strip in itertools.chain((strip,), strips):
+            assert top % (line_height*8) == 0
+            # rotate and mirror is a transpose, rows turn into printer columns
+            planes = _pack(_separate(strip.transpose(1, 0, 2), colour, stats, engines, line_height*8, top),
+                    line_height, stats)
+            cut_at = options['cut_at'] - top if cut else None
+            yield from _encode_bands(planes, range(0, len(strip), line_height*8), stats=stats, **dict(options, cut_at=cut_at))
+            top += len(strip)
+            del planes
+
+    # Enter ESC/P2 graphics mode
+    head = [profile['raster']] if raster else []
+    tail = [b"\r\n"] if cut else []
+    yield from _assemble(itertools.chain(head, ops(strip), tail), profile, schedule, stats)
+
+    return lines
+
+def _pnm_header(fp):
+    # Type, fields and data offset of a raw PBM/PGM/PPM file
+    magic = fp.read(2)
+    fields = []
+    c = fp.read(1)
+    while len(fields) < (2 if magic == b"P4" else 3):
+        if c == b"#":
+            fp.readline()
+            c = fp.read(1)
+        elif c.isspace():
+            c = fp.read(1)
+        else:
+            token = b""
+            while c and not c.isspace():
+                token += c
+                c = fp.read(1)
+            fields.append(int(token))
+    # a single whitespace ends the header
+    return magic, fields, fp.tell()
+
+def _read_strips(path, rows, left_offset=0):
+    # Generator of the RGB strips of up to rows rows of an image file and its number of rows,
+    # padded with left_offset white columns. Raw PBM/PGM/PPM files are memory-mapped, other
+    # formats are decoded once by PIL but not converted to RGB as a whole.
+    with open(path, 'rb') as fp:
+        magic = fp.read(2)
+        if magic in (b"P4",b"P5",b"P6"):
+            fp.seek(0)
+            magic, fields, offset = _pnm_header(fp)
+
+    if magic == b"P4" or (magic in (b"P5",b"P6") and fields[2] < 256):
+        width, height = fields[:2]
+        shape = {b"P4": (height, (width+7)//8), b"P5": (height, width), b"P6": (height, width, 3)}[magic]
+        data = np.memmap(path, np.uint8, 'r', offset, shape)
+        if magic != b"P4" and fields[2] != 255:
+            # samples of another maxval are scaled as PIL does, rounded and not above 255
+            scale = np.array([min(255, round(value / fields[2] * 255)) for value in range(256)], np.uint8)
+        def strip(top):
+            part = data[top:top+rows]
+            if magic == b"P4":
+                part = (1 - np.unpackbits(part, axis=1)[:, :width]) * 255
+            elif fields[2] != 255:
+                part = scale[part]
+            part = part.astype(np.uint8)
+            return part if magic == b"P6" else np.repeat(part[..., None], 3, axis=2)
+    else:
+        im = Image.open(path)
+        width, height = im.size
+        def strip(top):
+            return np.asarray(im.crop((0, top, width, min(top+rows, height))).convert("RGB"))
+
+    def strips():
+        for top in range(0, height, rows):
+            yield np.pad(strip(top), ((0, 0), (left_offset, 0), (0, 0)), constant_values=255)
+
+    return strips(), height
+
+def _write_stream(stream, write):
+    # Passes every chunk of a column format stream to write, returns lines
+    while True:
+        try:
+            write(next(stream))
+        except StopIteration as stop:
+            return stop.value
+
+def _to_column_format(im,*args,**kwargs):
+    image = []
+    lines = _write_stream(_iter_column_format(im,*args,**kwargs), image.append)
+    return b"".join(image), lines
+
+class Encoder:
+    # _to_column_format with one printer profile and set of options for many jobs, e.g. in
+    # a service process: the options are checked, the dither is parsed and the profile and
+    # pass commands are looked up once, when the encoder is built, and used by every job
+    def __init__(self, printer="24pin", colour='cmyk', overscan=2, mode=39, skip=1, cut=False, elide=False,
+            trim=False, raster=False, schedule=False, dither=None, workers=0, paper_width=0):
+        self.setup = _band_setup(colour,overscan,mode,printer,skip,elide,trim,raster,schedule)
+        self.profile = self.setup['profile']
+        self.engines = _parse_dither(dither, colour)
+        self.options = dict(printer=printer, colour=colour, overscan=overscan, mode=mode, skip=skip, cut=cut,
+                elide=elide, trim=trim, raster=raster, schedule=schedule, workers=workers)
+        self.init = _printer_init(printer, paper_width)
+
+    def iter(self, im, stats=_nostats, template=None):
+        return _iter_column_format(im, engines=self.engines, setup=self.setup, stats=stats, template=template, **self.options)
+
+    def encode(self, im, stats=_nostats):
+        # bytes and lines as _to_column_format, without the printer init
+        image = []
+        lines = _write_stream(self.iter(im, stats), image.append)
+        return b"".join(image), lines
+
+@functools.lru_cache(maxsize=16)
+def _encoder(**options):
+    # Encoder of these options kept for the next jobs of the process (spooler, batch workers)
+    return Encoder(**options)
+
+def _add_arguments(parser, image=True):
+    # Printer and encoding options shared by the command line tools, without colour and
+    # dither (black, as for k) for tools whose ink is already 1 bit (image=False)
     parser.add_argument('-p', '--printer', default='9pin',
-                    help='printer type (9pin or 24pin)')
-    parser.add_argument('-c', '--colour',
-                    default='k', type=str,
-                    help='use colours')
+                    help='printer type, a profile of %s (%s)' % (os.path.basename(PROFILES), ", ".join(_profiles())))
+    if image:
+        parser.add_argument('-c', '--colour',
+                        default='k', type=str,
+                        help='use colours')
+    else:
+        parser.set_defaults(colour='k', dither=None)
     parser.add_argument('-m', '--mode', default=5, type=int,
                     help='mode to use for printing')
     parser.add_argument('-o', '--overscan', default=1, type=int,
@@ -181,46 +747,264 @@ if __name__ == "__main__":
                     help='set paper width in escpos ("GS ( E <5> <3>")')
     parser.add_argument('-l', '--left-offset', default=0, type=int,
                     help='append white on left side for alignment')
+    parser.add_argument('-e', '--elide', action="store_true",
+                    help='skip blank bands and colours, feed paper instead')
+    parser.add_argument('-t', '--trim', action="store_true",
+                    help='skip white on both sides of every pass (not for oki and escpos)')
+    parser.add_argument('-r', '--raster', action="store_true",
+                    help='compressed ESC/P2 raster graphics (24pin, modes 32-40)')
+    if image:
+        parser.add_argument('-d', '--dither',
+                        help='dither engine fs, bayer, bluenoise or band, per plane as in "bayer,k=band" (default fs)')
+    parser.add_argument('--workers', default=0, type=int,
+                    help='encode bands in that many processes')
+    parser.add_argument('--schedule', action="store_true",
+                    help='drop empty colour passes and order colours for fewer ribbon shifts')
     parser.add_argument('--cut', action="store_true",
                     help='papercut top image')
     parser.add_argument('-n','--count', default=1, type=int,
                     help='print n times')
 
-    args = parser.parse_args()
+def _add_cache_arguments(parser):
+    # Job cache options of the tools that encode whole jobs from files
+    parser.add_argument('--cache',
+                    help='directory of the encoded job cache')
+    parser.add_argument('--cache-size', default=256, type=int,
+                    help='cache size limit in MB, least recently used jobs are dropped')
+
+def _add_stats_arguments(parser):
+    # Report options of the tools that write the stream themselves
+    parser.add_argument('--stats',
+                    help='write stage timings and print time estimate as JSON to file (- for stderr)')
+    parser.add_argument('--link', default=0, type=int,
+                    help='link speed in bytes per second for the print time estimate')
 
-    # Load Image
-    im = Image.open(args.input)
-    
-    if args.left_offset:
+def _encoding_options(args):
+    # keyword arguments of _iter_column_format from parsed command line
+    return dict(printer=args.printer,
+            colour=args.colour,
+            mode=args.mode,
+            overscan=args.overscan,
+            skip=args.skip,
+            cut=args.cut,
+            elide=args.elide,
+            trim=args.trim,
+            raster=args.raster,
+            schedule=args.schedule,
+            dither=args.dither,
+            workers=args.workers)
+
+def _open_image(path, left_offset=0):
+    return _pad(Image.open(path), left_offset)
+
+def _pad(im, left_offset):
+    if left_offset:
+        from PIL import ImageOps
         im = ImageOps.pad(im,
-                          [sum(x) for x in zip(im.size,(args.left_offset,0))],
+                          [sum(x) for x in zip(im.size,(left_offset,0))],
                           method=Image.Resampling.NEAREST,
                           centering=(1,0.5),
                           color='#fff')
+    return im
+
+def _report(stats, printer, mode, lines, count=1, link=0):
+    # Stage timings, counts and estimated physical print time of count copies of a job.
+    # The mechanics of the profile are rough: head speed limit in inches per second, dot
+    # columns per second, seconds per carriage return, paper feed in inches per second and
+    # seconds per ribbon shift
+    profile = _profile(printer)
+    m = profile['mechanics']
+    hdpi = profile['hdpi'].get(mode, 60)
+    colours = [p[0] for p in stats.passes]
+    switches = sum(a != b for a, b in zip(colours, colours[1:]))
+    if colours and profile['colour'] is not None:
+        switches = switches * count + (colours[0] != colours[-1]) * (count - 1)
+    else:
+        switches = 0
+    graphics = sum(p[3] for p in stats.passes)
+    head = sum(max((start + columns) / hdpi / m['ips'], columns / m['cps']) + m['ret']
+            for col, start, columns, size in stats.passes) * count
+    feed = lines * count / profile['unit'] / m['feed']
+    mechanical = head + switches * m['ribbon'] + feed
+    transfer = stats.counts.get('output', 0) / link if link else 0
+    return {'stages': stats.times,
+            'bytes': {'output': stats.counts.get('output', 0), 'graphics': graphics * count},
+            'head_passes': len(stats.passes) * count,
+            'ribbon_switches': switches,
+            'graphics_bytes_per_pass': graphics / len(stats.passes) if stats.passes else 0,
+            'lines': lines * count,
+            'reused_bands': stats.counts.get('reused_bands', 0),
+            'estimate': {'head': head,
+                    'ribbon': switches * m['ribbon'],
+                    'feed': feed,
+                    'link': transfer,
+                    # the printer prints while the link is still sending
+                    'total': max(mechanical, transfer)}}
+
+def _parse_target(spec):
+    # printer:mode:overscan:skip:output of the --target option
+    printer, mode, overscan, skip, output = spec.split(':', 4)
+    return dict(printer=printer, mode=int(mode), overscan=int(overscan), skip=int(skip)), output
+
+def _planes(im, left_offset, colour, cache=None, stats=_nostats, dither=None, band=None):
+    # Separation stage of a not yet padded image, through the cache when there is one
+    if cache:
+        key = cache.planes_key(im, left_offset, colour, dither, band)
+        planes = cache.get_planes(key)
+        if planes is None:
+            planes = _separate_image(_pad(im, left_offset), colour, stats, dither, band)
+            cache.put_planes(key, planes)
+        return planes
+    return _separate_image(_pad(im, left_offset), colour, stats, dither, band)
+
+def _printer_init(printer, paper_width=0):
+    image = b""
+    if paper_width:
+        image += b'\x1d(E\x03\x00\x01IN'
+        image += b'\x1d(E\x04\x00\x05\x03' + struct.pack('<H',paper_width)
+        image += b'\x1d(E\x04\x00\x02OUT'
+
+    image += _profile(printer)['init']
+    return image
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Process image for escp printer.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input',
+                    help='input image')
+    parser.add_argument('output', default='-', nargs='?',
+                    help='output file (dafaults to stdout)')
+    _add_arguments(parser)
+    parser.add_argument('-b', '--strip-bands', default=0, type=int,
+                    help='read, dither and encode the file that many bands at a time (bounded memory)')
+    parser.add_argument('--template',
+                    help='file of encoded bands of a base image (made from this image when missing), '
+                    'only bands that differ from it are encoded')
+    parser.add_argument('-T', '--target', action='append',
+                    help='separate once, encode for printer:mode:overscan:skip:output (repeatable)')
+    _add_cache_arguments(parser)
+    _add_stats_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.template and (args.strip_bands or args.target):
+        parser.error('--template needs the whole image, not --strip-bands or --target')
+
+    if args.cache and args.strip_bands:
+        parser.error('--cache needs the whole image, not --strip-bands')
+
+    if args.workers > 1 and args.strip_bands:
+        parser.error('--workers needs the whole image, not --strip-bands')
+
+    if args.target:
+        if args.strip_bands:
+            parser.error('--target needs the whole image, not --strip-bands')
+        cache = jobcache.JobCache(args.cache, args.cache_size << 20) if args.cache else None
+        # band dither error stays within the bands of the main options
+        planes = _planes(Image.open(args.input), args.left_offset, args.colour, cache,
+                dither=args.dither, band=args.overscan*_mode_width(args.mode)*8)
+        for spec in args.target:
+            target, output = _parse_target(spec)
+            options = dict(_encoding_options(args), **target)
+            del options['colour'], options['dither']
+            image = []
+            lines = _write_stream(_iter_plane_format(planes, args.colour, **options), image.append)
+            with open(output, 'wb') as fp:
+                fp.write(_printer_init(target['printer'], args.paper_width))
+                fp.write(b"".join(image) * args.count)
+        sys.exit()
 
     if args.output == '-':
         fp=os.fdopen(sys.stdout.fileno(), 'wb')
     else:
         fp=open(args.output,'wb')
    
+    stats = _Stats() if args.stats else _nostats
+
     # Initialize printer
+    init = _printer_init(args.printer, args.paper_width)
+    fp.write(init)
+    stats.count('output', len(init))
+
+    # Send every band as soon as it is encoded, keep a copy only for repeats and the cache
+    copies = []
+    def emit(chunk):
+        with stats.stage('output'):
+            fp.write(chunk)
+            fp.flush()
+        stats.count('output', len(chunk))
+        if args.count > 1 or args.cache:
+            copies.append(chunk)
 
-    if args.paper_width:
-        fp.write(b'\x1d(E\x03\x00\x01IN')
-        fp.write(b'\x1d(E\x04\x00\x05\x03' + struct.pack('<H',args.paper_width))
-        fp.write(b'\x1d(E\x04\x00\x02OUT')
+    options = _encoding_options(args)
+    job = None
+    if args.cache:
+        cache = jobcache.JobCache(args.cache, args.cache_size << 20)
+        with stats.stage('decode'):
+            im = Image.open(args.input)
+            im.load()
+        key = cache.key(im, args.left_offset, options)
+        job, lines = cache.open(key)
 
-    if args.printer == "oki":
-        fp.write(b'\x18' + ESC + b'\x55\x00')
+    if job:
+        with job:
+            with stats.stage('output'):
+                for _ in range(args.count):
+                    job.seek(8)
+                    shutil.copyfileobj(job, fp)
+                # the cached file is the line count and the job
+                stats.count('output', (os.fstat(job.fileno()).st_size - 8) * args.count)
+            if args.stats:
+                # the passes of the estimate are read back from the cached stream
+                import virtualprinter
+                printer = virtualprinter.VirtualPrinter(args.printer)
+                with stats.stage('parse'):
+                    job.seek(8)
+                    for chunk in iter(lambda: job.read(1 << 16), b""):
+                        printer.write(chunk)
+                    printer.close()
+                stats.passes += printer.stats.passes
     else:
-        fp.write(ESC + b'@' + ESC + b'P' + ESC + b'l\x00' + b'\r' + ESC + b'Q\x00')
+        options['stats'] = stats
+        if args.template:
+            options['template'] = template = jobcache.Template(args.template)
+        if args.strip_bands:
+            # workers is 0 or 1 here, strips are encoded in this process
+            del options['workers']
+            rows = args.strip_bands * args.overscan*_mode_width(args.mode)*8
+            stream = _iter_strip_format(*_read_strips(args.input, rows, args.left_offset), **options)
+        else:
+            # Load Image
+            with stats.stage('decode'):
+                im = Image.open(args.input)
+                im.load()
+            # templates hold the digests of the bands as _iter_column_format dithers them,
+            # levels with band local engines, so they do not go through the cached planes
+            if args.cache and not args.template:
+                colour = options.pop('colour')
+                planes = _planes(im, args.left_offset, colour, cache, stats,
+                        options.pop('dither'), args.overscan*_mode_width(args.mode)*8)
+                stream = _iter_plane_format(planes, colour, **options)
+            else:
+                stream = _iter_column_format(_pad(im, args.left_offset), **options)
 
-    blob, lines = _to_column_format(im,
-            printer=args.printer,
-            colour=args.colour,
-            mode=args.mode,
-            overscan=args.overscan,
-            skip=args.skip,
-            cut=args.cut)
-    for _ in range(args.count):
-        fp.write(blob)
+        lines = _write_stream(stream, emit)
+        blob = b"".join(copies)
+        with stats.stage('output'):
+            for _ in range(args.count-1):
+                fp.write(blob)
+        stats.count('output', len(blob) * (args.count-1))
+        if args.cache:
+            cache.put(key, blob, lines)
+        if args.template:
+            template.save()
+            stats.count('reused_bands', template.reused)
+
+    if args.stats:
+        report = _report(stats, args.printer, args.mode, lines, args.count, args.link)
+        # a cached job was not encoded, its passes are those of the cached stream
+        report['cached'] = bool(job)
+        with (sys.stderr if args.stats == '-' else open(args.stats, 'w')) as out:
+            json.dump(report, out, indent=1)
+            out.write("\n")
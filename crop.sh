@@ -1,3 +0,0 @@
-#!/bin/bash
-
-dd if=peek.f03ee of=font.bin bs=1 skip=26624 count=4752
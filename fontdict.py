@@ -1,175 +0,0 @@
-#!/usr/bin/env python3
-fontdict={
-        '♥':('font.bin',96),
-        '♦':('font.bin',108),
-        '♣':('font.bin',120),
-        '♠':('font.bin',132),
-        '§':('font.bin',144),
-        ' ':('font.bin',156),
-        '!':('font.bin',168),
-        '"':('font.bin',180),
-        '#':('font.bin',192),
-        '$':('font.bin',204),
-        '%':('font.bin',216),
-        '&':('font.bin',228),
-        "'":('font.bin',240),
-        "(":('font.bin',252),
-        ")":('font.bin',264),
-        "*":('font.bin',276),
-        "+":('font.bin',288),
-        ",":('font.bin',300),
-        "-":('font.bin',312),
-        ".":('font.bin',324),
-        "/":('font.bin',336),
-        #"0":('font.bin',348),
-        "1":('font.bin',360),
-        "2":('font.bin',372),
-        "3":('font.bin',384),
-        "4":('font.bin',396),
-        "5":('font.bin',408),
-        "6":('font.bin',420),
-        "7":('font.bin',432),
-        "8":('font.bin',444),
-        "9":('font.bin',456),
-        ":":('font.bin',468),
-        ";":('font.bin',480),
-        "<":('font.bin',492),
-        "=":('font.bin',504),
-        ">":('font.bin',516),
-        "?":('font.bin',528),
-        "@":('font.bin',540),
-        "A":('font.bin',552),
-        "B":('font.bin',564),
-        "C":('font.bin',576),
-        "D":('font.bin',588),
-        "E":('font.bin',600),
-        "F":('font.bin',612),
-        "G":('font.bin',624),
-        "H":('font.bin',636),
-        "I":('font.bin',648),
-        "J":('font.bin',660),
-        "K":('font.bin',672),
-        "L":('font.bin',684),
-        "M":('font.bin',696),
-        "N":('font.bin',708),
-        "O":('font.bin',720),
-        "P":('font.bin',732),
-        "Q":('font.bin',744),
-        "R":('font.bin',756),
-        "S":('font.bin',768),
-        "T":('font.bin',780),
-        "U":('font.bin',792),
-        "V":('font.bin',804),
-        "W":('font.bin',816),
-        "X":('font.bin',828),
-        "Y":('font.bin',840),
-        "Z":('font.bin',852),
-        "[":('font.bin',864),
-        "\\":('font.bin',876),
-        "]":('font.bin',888),
-        "^":('font.bin',900),
-        "_":('font.bin',912),
-        "`":('font.bin',924),
-        "a":('font.bin',936),
-        "b":('font.bin',948),
-        "c":('font.bin',960),
-        "d":('font.bin',972),
-        "e":('font.bin',984),
-        "f":('font.bin',996),
-        "g":('font.bin',1008),
-        "h":('font.bin',1020),
-        "i":('font.bin',1032),
-        "j":('font.bin',1044),
-        "k":('font.bin',1056),
-        "l":('font.bin',1068),
-        "m":('font.bin',1080),
-        "n":('font.bin',1092),
-        "o":('font.bin',1104),
-        "p":('font.bin',1116),
-        "q":('font.bin',1128),
-        "r":('font.bin',1140),
-        "s":('font.bin',1152),
-        "t":('font.bin',1164),
-        "u":('font.bin',1176),
-        "v":('font.bin',1188),
-        "w":('font.bin',1200),
-        "x":('font.bin',1212),
-        "y":('font.bin',1224),
-        "z":('font.bin',1236),
-        "{":('font.bin',1248),
-        "|":('font.bin',1260),
-        "}":('font.bin',1272),
-        "~":('font.bin',1284),
-        #" ":('font.bin',1296),
-        "░":('font.bin',1884),
-        "▒":('font.bin',1896),
-        "▓":('font.bin',1908),
-        "│":('font.bin',1920),
-        "┤":('font.bin',1932),
-        "╡":('font.bin',1944),
-        "╢":('font.bin',1956),
-        "╖":('font.bin',1968),
-        "╕":('font.bin',1980),
-        "╣":('font.bin',1992),
-        "║":('font.bin',2004),
-        "╗":('font.bin',2016),
-        "╝":('font.bin',2028),
-        "╜":('font.bin',2040),
-        "╛":('font.bin',2052),
-        "┐":('font.bin',2064),
-        "└":('font.bin',2076),
-        "┴":('font.bin',2088),
-        "┬":('font.bin',2100),
-        "├":('font.bin',2112),
-        "─":('font.bin',2124),
-        "┼":('font.bin',2136),
-        "╞":('font.bin',2148),
-        "╟":('font.bin',2160),
-        "╚":('font.bin',2172),
-        "╔":('font.bin',2184),
-        "╩":('font.bin',2196),
-        "╦":('font.bin',2208),
-        "╠":('font.bin',2220),
-        "═":('font.bin',2232),
-        "╬":('font.bin',2244),
-        "╧":('font.bin',2256),
-        "╨":('font.bin',2268),
-        "╤":('font.bin',2280),
-        "╥":('font.bin',2292),
-        "╨":('font.bin',2304),
-        "╘":('font.bin',2316),
-        "╒":('font.bin',2328),
-        "╓":('font.bin',2340),
-        "╫":('font.bin',2352),
-        "╪":('font.bin',2364),
-        "┘":('font.bin',2376),
-        "┌":('font.bin',2388),
-        "█":('font.bin',2400),
-        "▄":('font.bin',2412),
-        "▌":('font.bin',2424),
-        "▐":('font.bin',2436),
-        "▀":('font.bin',2448),
-        "±":('font.bin',2664),
-        "≥":('font.bin',2676),
-        "≤":('font.bin',2688),
-        #"∫":('font.bin',2700),
-        #"∫":('font.bin',2712),
-        "÷":('font.bin',2724),
-        "≈":('font.bin',2736),
-        "°":('font.bin',2748),
-        "√":('font.bin',2784),
-        #"?":('font.bin',2796),
-        "²":('font.bin',2808),
-        "•":('font.bin',2820),
-        #" ":('font.bin',2832),
-        "•":('font.bin',2820),
-        "0":('font.bin',3648),
-        }
-
-def getfont(char):
-    d=fontdict[char]
-    f=open(d[0],'rb')
-    f.seek(d[1],0)
-    r=f.read(12)
-    f.close()
-    return r
@@ -1,20 +1,179 @@
 #!/usr/bin/env python3
 
 from PIL import Image
+import numpy as np
+import columnFormat
+import romfont
+import functools
+import struct
+import json
 import sys
+import os
+
+def _atlas_files(fontdir):
+    # kept next to the font directory, writing them does not touch its mtime
+    base = os.path.normpath(fontdir) + '.atlas'
+    return base + '.npy', base + '.json'
+
+def _build_atlas(fontdir):
+    # Ink (True = black) of every glyph PNG of fontdir stacked in one array, and its characters
+    chars, glyphs = [], []
+    for name in sorted(os.listdir(fontdir)):
+        if not name.endswith('.png'):
+            continue
+        # "/" can not be a file name, out9//.png is saved as .png
+        chars.append(name[:-4] or '/')
+        glyphs.append(~np.asarray(Image.open(os.path.join(fontdir, name)).convert("1")))
+    return np.stack(glyphs), chars
+
+@functools.lru_cache()
+def atlas(fontdir):
+    # Glyphs of fontdir as an (n, height, width) bool array, memory-mapped from the atlas
+    # file, and a dict of their index by character. The atlas is built from the PNGs on
+    # first use and again when the font directory changes. fontdir can also be a font
+    # file of romfont.py.
+    if os.path.isfile(fontdir):
+        return romfont.load(fontdir)
+    array, index = _atlas_files(fontdir)
+    try:
+        fresh = os.stat(array).st_mtime >= os.stat(fontdir).st_mtime
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        glyphs, chars = _build_atlas(fontdir)
+        try:
+            np.save(array, glyphs)
+            with open(index, 'w') as fp:
+                json.dump(chars, fp)
+        except OSError:
+            # read only font directory, keep the atlas in memory
+            return glyphs, {char: i for i, char in enumerate(chars)}
+    with open(index) as fp:
+        chars = json.load(fp)
+    return np.load(array, mmap_mode='r'), {char: i for i, char in enumerate(chars)}
+
+def _cells(textlines, index):
+    # glyph index of every character cell, -1 pads short lines
+    xline = max((len(line) for line in textlines), default=0)
+    cells = np.full((len(textlines), xline), -1, np.intp)
+    for y, line in enumerate(textlines):
+        cells[y, :len(line)] = [index[char] for char in line]
+    return cells
+
+def _ink(textlines, fontdir):
+    # Ink of the text lines as (lines, glyph height, columns, glyph width)
+    glyphs, index = atlas(fontdir)
+    cells = _cells(textlines, index)
+    ink = glyphs[np.maximum(cells, 0)]
+    ink[cells < 0] = False
+    return ink.transpose(0, 2, 1, 3)
 
 def render(textlines,fontdir):
-    space=Image.open(fontdir+"/ .png")
-    width_pixels, height_pixels = space.size
-    xline=0
+    ink = _ink(textlines, fontdir)
+    lines, height_pixels, xline, width_pixels = ink.shape
+    return Image.fromarray(~ink.reshape(lines*height_pixels, xline*width_pixels))
+
+def planes(textlines, fontdir):
+    # Separation stage of columnFormat for rendered text: the ink is already 1 bit, so the
+    # black plane is the rotated and mirrored bitmap, composed from the glyphs directly
+    ink = _ink(textlines, fontdir)
+    lines, height_pixels, xline, width_pixels = ink.shape
+    return {0: ink.transpose(2, 3, 0, 1).reshape(xline*width_pixels, lines*height_pixels)}
+
+def to_column_format(textlines, fontdir, left_offset=0, **options):
+    # columnFormat._to_column_format(render(textlines, fontdir), colour='k', **options)
+    # without the image round trip, returns the bytes and lines. left_offset white columns
+    # are added on the left as by columnFormat._pad.
+    ink = planes(textlines, fontdir)
+    if left_offset:
+        ink = {col: np.pad(plane, ((left_offset, 0), (0, 0))) for col, plane in ink.items()}
+    image = []
+    lines = columnFormat._write_stream(columnFormat._iter_plane_format(ink, 'k', **options), image.append)
+    return b"".join(image), lines
+
+ESC = b"\x1b"
+
+# Codes that downloaded glyphs can take when the text does not use them
+_SLOTS = range(33, 127)
+
+# Glyph cells (height, width) of character mode are the "cell" of the printer profile:
+# 24 dot cells of 24 pin printers, or 9 dot cells of which the glyphs use 8 rows (ESC &
+# attribute bit 7 selects the upper pins)
+
+def _line_spacing(profile):
+    # ESC 3 line spacing of one character cell, its rows are the pins of one byte per column
+    # graphics (9 pin) or three (24 pin)
+    height = profile['cell'][0]
+    return height * profile.get('spacing_unit', profile['unit']) // profile['pins'][height // 8]
+
+def _definition(ink):
+    # ESC & data of one glyph, None when it does not fit a download character
+    if len(ink) == 24:
+        # draft: left space, at most 9 columns of 3 bytes, right space
+        if ink[:, 9:].any():
+            return None
+        return bytes((0, 9, 3)) + np.packbits(ink[:, :9].T, axis=1).tobytes()
+    if ink[0].any() and ink[8].any():
+        return None
+    upper = not ink[8].any()
+    rows = ink[0:8] if upper else ink[1:9]
+    # attribute: pins, proportional start and end column
+    return bytes((0x80*upper | 0x0b,)) + np.packbits(rows.T, axis=1).tobytes()
+
+def _graphics(ink):
+    # Bit image of one glyph, for glyphs that can not be downloaded
+    if len(ink) == 24:
+        # 24 dot 120 dpi, same dots as a draft character
+        return ESC + b"*" + struct.pack("<BH", 33, ink.shape[1]) + np.packbits(ink.T, axis=1).tobytes()
+    # 9 pin 120 dpi, two bytes per column with the 9th dot in bit 7 of the second
+    return ESC + b"^" + struct.pack("<BH", 1, ink.shape[1]) + np.packbits(np.pad(ink.T, ((0, 0), (0, 7))), axis=1).tobytes()
+
+def to_text_mode(textlines, fontdir, printer="24pin"):
+    # Printer commands printing the text in character mode. The ROM characters are copied
+    # to RAM, the glyphs of fontdir used by the text and missing in ASCII are downloaded
+    # into ASCII codes the text does not use. Glyphs that do not fit a download character
+    # or a free code are printed as bit images in their cell after the text of the line.
+    profile = columnFormat._profile(printer)
+    cell = profile.get('cell')
+    if cell is None:
+        raise Exception("%s printer has no character mode cell in its profile" % printer)
+    glyphs, index = atlas(fontdir)
+    if glyphs.shape[1:] != tuple(cell):
+        raise Exception("font %s does not fit %s character mode" % (fontdir, printer))
+    used = set("".join(textlines))
+    native = {char for char in used if " " <= char <= "~"}
+    free = [code for code in _SLOTS if chr(code) not in native]
+    slots = {}
+    # lines as high as the cell, so that box drawing strokes meet as in render()
+    image = bytearray(ESC + b"3" + bytes((_line_spacing(profile),)))
+    if cell[0] == 24:
+        # the 24 pin ROM font is the draft one
+        image += ESC + b"x\0"
+    image += ESC + b":\0\0\0"
+    for char in sorted(used - native):
+        data = _definition(np.asarray(glyphs[index[char]]))
+        if data is not None and free:
+            slots[char] = code = free.pop(0)
+            image += ESC + b"&\0" + bytes((code, code)) + data
+    image += ESC + b"%\1"
     for line in textlines:
-        xline=max(xline,len(line))
-    im=Image.new("1",(xline*width_pixels,len(textlines)*height_pixels),1)
-    for y in range(0,len(textlines)):
-        for x in range(0,len(textlines[y])):
-            glyph=Image.open(fontdir+'/'+textlines[y][x]+'.png')
-            im.paste(glyph,(x*width_pixels,y*height_pixels))
-    return im
+        text = bytearray()
+        graphics = bytearray()
+        for x, char in enumerate(line):
+            if char in native:
+                text.append(ord(char))
+            elif char in slots:
+                text.append(slots[char])
+            else:
+                text.append(32)
+                # cells are 1/10 inch, ESC $ counts 1/60
+                graphics += ESC + b"$" + struct.pack("<H", x*6) + _graphics(np.asarray(glyphs[index[char]]))
+        image += text.rstrip(b" ")
+        if graphics:
+            image += b"\r" + graphics
+        image += b"\r\n"
+    image += ESC + b"%\0"
+    return bytes(image)
 
 if __name__ == "__main__":
     import argparse
@@ -23,10 +182,26 @@ if __name__ == "__main__":
     parser.add_argument('output',
                     help='output image')
     parser.add_argument('-f', '--font', default="out24", type=str,
-                    help='mode to use for printing')
+                    help='font directory of glyph PNGs or font file from romfont.py')
+    parser.add_argument('-E', '--escp', action="store_true",
+                    help='write printer commands instead of an image, see columnFormat options')
+    parser.add_argument('-X', '--text-mode', action="store_true",
+                    help='write printer commands in character mode with downloaded glyphs (printers with a cell in their profile)')
+    # the ink of the glyphs is black and 1 bit, there is no colour or dither to choose
+    columnFormat._add_arguments(parser, image=False)
     args = parser.parse_args()
 
     data = sys.stdin.read().splitlines()
 
-    im = render(data,args.font)
-    im.save(args.output)
+    if args.text_mode or args.escp:
+        if args.text_mode:
+            blob = to_text_mode(data, args.font, args.printer)
+        else:
+            options = columnFormat._encoding_options(args)
+            del options['colour'], options['dither']
+            blob, lines = to_column_format(data, args.font, args.left_offset, **options)
+        with open(args.output, 'wb') as fp:
+            fp.write(columnFormat._printer_init(args.printer, args.paper_width) + blob * args.count)
+    else:
+        im = render(data,args.font)
+        im.save(args.output)
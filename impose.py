@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+N-up imposition of small labels.
+
+The copies of every label are packed side by side across the printable
+width and in shelves down the sheet (first fit by decreasing height), and
+each sheet is encoded as one stream. A batch of labels then shares its
+head passes and paper feed instead of printing one label after another.
+
+    impose.py -p 24pin -m 39 -o 2 -W 1400 -g 8 a.png b.png:20 c.png:5 -O sheet.prn
+
+A label is given as path or path:count, labels without a count are
+printed --count times. The printable width is --sheet-width in dots of
+the mode, or --paper-width in mm, less --left-offset.
+"""
+
+from PIL import Image
+import columnFormat
+import json
+import sys
+import os
+
+def layout(sizes, width, gap=0, length=0):
+    # (sheet, x, y) of boxes of sizes (width, height) packed in shelves across width, a new
+    # sheet is started where a shelf would end past length (0 for one endless sheet)
+    places = [None] * len(sizes)
+    shelves = [] # [sheet, y, height, next x]
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if w > width or (length and h > length):
+            raise Exception("label %d of %dx%d does not fit the sheet" % (i, w, h))
+        for shelf in shelves:
+            # shelves are never lower than the boxes still to come
+            if shelf[3] + w <= width:
+                break
+        else:
+            sheet, y = 0, 0
+            if shelves:
+                sheet, y = shelves[-1][0], shelves[-1][1] + shelves[-1][2] + gap
+                if length and y + h > length:
+                    sheet, y = sheet + 1, 0
+            shelf = [sheet, y, h, 0]
+            shelves.append(shelf)
+        places[i] = (shelf[0], shelf[3], shelf[1])
+        shelf[3] += w + gap
+    return places
+
+def impose(images, width, gap=0, length=0):
+    # RGB sheets of images placed by layout, as wide as width
+    places = layout([im.size for im in images], width, gap, length)
+    heights = {}
+    for im, (sheet, x, y) in zip(images, places):
+        heights[sheet] = max(heights.get(sheet, 0), y + im.size[1])
+    sheets = [Image.new("RGB", (width, heights[sheet]), '#fff') for sheet in sorted(heights)]
+    for im, (sheet, x, y) in zip(images, places):
+        sheets[sheet].paste(im.convert("RGB"), (x, y))
+    return sheets
+
+def _label(spec, count):
+    # path and copies of path or path:count
+    path, _, n = spec.rpartition(':')
+    if path and n.isdigit():
+        return path, int(n)
+    return spec, count
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Pack many labels on shared sheets for escp printer.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', nargs='+',
+                    help='label images as path or path:count')
+    parser.add_argument('-O', '--output', default='-',
+                    help='output file (dafaults to stdout)')
+    parser.add_argument('-W', '--sheet-width', default=0, type=int,
+                    help='printable width in dots of the mode (defaults to --paper-width in mm)')
+    parser.add_argument('-L', '--sheet-length', default=0, type=int,
+                    help='start a new sheet after that many rows (0 for one sheet)')
+    parser.add_argument('-g', '--gap', default=0, type=int,
+                    help='white dots between labels')
+    parser.add_argument('--png',
+                    help='write the sheets as images instead, e.g. "sheet{index}.png"')
+    columnFormat._add_arguments(parser)
+    columnFormat._add_stats_arguments(parser)
+
+    args = parser.parse_args()
+
+    width = args.sheet_width
+    hdpi = columnFormat._profile(args.printer)['hdpi']
+    if not width and args.paper_width and args.mode in hdpi:
+        width = args.paper_width * hdpi[args.mode] * 10 // 254
+    if width <= args.left_offset:
+        parser.error('--sheet-width or --paper-width needed, wider than --left-offset')
+
+    images = []
+    for spec in args.input:
+        path, count = _label(spec, args.count)
+        im = Image.open(path)
+        im.load()
+        images += [im] * count
+    sheets = impose(images, width - args.left_offset, args.gap, args.sheet_length)
+
+    if args.png:
+        for index, sheet in enumerate(sheets):
+            columnFormat._pad(sheet, args.left_offset).save(args.png.format(index=index))
+        sys.exit()
+
+    stats = columnFormat._Stats() if args.stats else columnFormat._nostats
+    encoder = columnFormat.Encoder(paper_width=args.paper_width, **columnFormat._encoding_options(args))
+    if args.output == '-':
+        fp=os.fdopen(sys.stdout.fileno(), 'wb')
+    else:
+        fp=open(args.output,'wb')
+    with fp:
+        fp.write(encoder.init)
+        stats.count('output', len(encoder.init))
+        lines = 0
+        for sheet in sheets:
+            blob, n = encoder.encode(columnFormat._pad(sheet, args.left_offset), stats)
+            fp.write(blob)
+            stats.count('output', len(blob))
+            lines += n
+
+    if args.stats:
+        report = columnFormat._report(stats, args.printer, args.mode, lines, 1, args.link)
+        report['labels'] = len(images)
+        report['sheets'] = len(sheets)
+        with (sys.stderr if args.stats == '-' else open(args.stats, 'w')) as out:
+            json.dump(report, out, indent=1)
+            out.write("\n")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of encoded print jobs and of separated colour planes.
+
+Jobs are keyed by a hash of the input pixels, the left offset and the
+encoding options, and stored as one file each: the lines total followed
+by the encoded stream. Files are written to a temporary name and renamed,
+so concurrent readers never see partial jobs. A hit touches the file and
+the least recently used files are evicted once the cache grows over its
+size limit. Dithered planes of the separation stage are kept the same
+way, so one image can be encoded for other printers without separating
+it again.
+
+A Template keeps the encoded bands of one base image, such as a form,
+with a hash of the pixels of every band. Jobs encoded against it take
+the bands that did not change from the template and encode only the
+others.
+"""
+
+import numpy as np
+import tempfile
+import hashlib
+import pickle
+import struct
+import fcntl
+import json
+import os
+
+# Bump when the encoder output changes for the same options
+VERSION = 1
+
+# options not changing the output bytes
+_IGNORED = ('workers', 'stats', 'template')
+
+class JobCache:
+    def __init__(self, path, max_size=256 << 20):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, im, left_offset, options):
+        h = hashlib.sha256()
+        params = {k: v for k, v in options.items() if k not in _IGNORED}
+        if 'printer' in params:
+            # the commands come from the printer profile, which can be edited
+            import columnFormat
+            params['profile'] = columnFormat._profile(params['printer'])['digest']
+        h.update(json.dumps([VERSION, im.mode, im.size, left_offset, params], sort_keys=True).encode())
+        if im.mode == "P":
+            h.update(bytes(im.getpalette()))
+        h.update(im.tobytes())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.job')
+
+    def open(self, key):
+        # file positioned at the stream and the lines total, or None when not cached
+        try:
+            fp = open(self._file(key), 'rb')
+        except FileNotFoundError:
+            return None, None
+        try:
+            os.utime(fp.fileno())
+        except OSError:
+            pass
+        lines, = struct.unpack("<Q", fp.read(8))
+        return fp, lines
+
+    def get(self, key):
+        fp, lines = self.open(key)
+        if fp is None:
+            return None
+        with fp:
+            return fp.read(), lines
+
+    def put(self, key, blob, lines):
+        def write(fp):
+            fp.write(struct.pack("<Q", lines))
+            fp.write(blob)
+        self._write(self._file(key), write)
+
+    def planes_key(self, im, left_offset, colour, dither=None, band=None):
+        return self.key(im, left_offset, {'colour': colour, 'dither': dither, 'band': band, 'stage': 'planes'})
+
+    def get_planes(self, key):
+        # bool arrays of the separation stage keyed by ESC r colour, or None when not cached
+        path = os.path.join(self.path, key + '.planes')
+        try:
+            with open(path, 'rb') as fp:
+                os.utime(fp.fileno())
+                data = np.load(fp)
+                width = int(data['width'])
+                return {int(col[1:]): np.unpackbits(data[col], axis=1)[:, :width].astype(bool)
+                        for col in data.files if col != 'width'}
+        except FileNotFoundError:
+            return None
+
+    def put_planes(self, key, planes):
+        width = np.shape(next(iter(planes.values())))[1]
+        packed = {'c%d' % col: np.packbits(np.asarray(plane), axis=1) for col, plane in planes.items()}
+        self._write(os.path.join(self.path, key + '.planes'),
+                lambda fp: np.savez(fp, width=width, **packed))
+
+    def _write(self, path, write):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as fp:
+                write(fp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Drops least recently used jobs until the cache fits in max_size
+        with open(os.path.join(self.path, '.lock'), 'wb') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            jobs = []
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(('.job', '.planes')):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    jobs.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(job[1] for job in jobs)
+            for mtime, job_size, path in sorted(jobs):
+                if size <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                size -= job_size
+
+class Template:
+    def __init__(self, path):
+        self.path = path
+        self.options = None
+        self.bands = {}
+        self.reused = 0
+        # a new template records the bands of its base image
+        self.new = not os.path.exists(path)
+        if self.new:
+            return
+        with open(path, 'rb') as fp:
+            version, self.options, self.bands = pickle.load(fp)
+        if version != VERSION:
+            raise Exception('template %s is from another encoder version' % path)
+
+    def check(self, options):
+        # The bands are only valid for the band options they were encoded with
+        if self.options is None:
+            self.options = options
+        elif self.options != options:
+            raise Exception('template %s was encoded with other options' % self.path)
+
+    def ops(self, left, digest, encode):
+        # ops of the band at left from the template when its pixels hash the same, else encoded
+        cached = self.bands.get(left)
+        if cached is not None and cached[0] == digest:
+            self.reused += 1
+            return cached[1]
+        ops = encode()
+        if self.new:
+            self.bands[left] = (digest, ops)
+        return ops
+
+    def save(self):
+        # Writes a new template once its base image is encoded, kept as is afterwards
+        if not self.new:
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump((VERSION, self.options, self.bands), fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
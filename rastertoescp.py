@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+CUPS filter from CUPS or PWG raster to ESC/P.
+
+    rastertoescp job-id user title copies options [file]
+
+Pages are read from the file or stdin a few bands at a time and every
+band is written to stdout as soon as it is encoded. Printer options come
+from the job options, named like the columnFormat command line options:
+
+    printer=24pin mode=39 overscan=2 colour=cmyk dither=bluenoise elide trim
+
+Booleans are set by their name and cleared by no<name>. Copies are left
+to CUPS. numpy, PIL and the encoder are imported when the first page
+arrives, so the filter starts without them.
+"""
+
+import struct
+import shlex
+import sys
+
+# Options of the job and their defaults, as in columnFormat._add_arguments
+DEFAULTS = {'printer': '9pin', 'colour': 'k', 'mode': 5, 'overscan': 1, 'skip': 1,
+        'paper-width': 0, 'left-offset': 0, 'strip-bands': 4, 'dither': None,
+        'cut': False, 'elide': False, 'trim': False, 'raster': False, 'schedule': False}
+
+# cups_page_header2_t fields by byte offset
+_HEADER_SIZE = 1796
+_FIELDS = {'width': 372, 'height': 376, 'bits_per_color': 384, 'bits_per_pixel': 388,
+        'bytes_per_line': 392, 'color_order': 396, 'color_space': 400, 'num_colors': 420}
+
+# cups_cspace_t values
+_W, _RGB, _K, _SW, _SRGB, _ADOBERGB = 0, 1, 3, 18, 19, 20
+
+# sync words: byte order and compressed lines
+_SYNC = {b"RaSt": ('>', False), b"tSaR": ('<', False),
+        b"RaS2": ('>', True), b"2SaR": ('<', True),
+        b"RaS3": ('>', False), b"3SaR": ('<', False)}
+
+def _options(text):
+    # Job options string of CUPS into encoder options
+    options = dict(DEFAULTS)
+    for item in shlex.split(text):
+        name, _, value = item.partition('=')
+        if name not in options and name.startswith('no') and name[2:] in options:
+            name, value = name[2:], 'false'
+        if name not in options:
+            # options of other filters and of CUPS itself
+            continue
+        if isinstance(DEFAULTS[name], bool):
+            options[name] = value.lower() not in ('false', 'no', 'off', '0')
+        elif isinstance(DEFAULTS[name], int):
+            options[name] = int(value)
+        else:
+            options[name] = value
+    return options
+
+def _header(data, order):
+    header = {name: struct.unpack_from(order + "I", data, offset)[0] for name, offset in _FIELDS.items()}
+    if header['color_space'] not in (_W, _RGB, _K, _SW, _SRGB, _ADOBERGB):
+        raise Exception("not supported colour space %d" % header['color_space'])
+    if header['bits_per_color'] not in (1, 8) or (header['bits_per_color'] == 1 and header['color_space'] not in (_W, _K, _SW)):
+        raise Exception("not supported %d bits per colour" % header['bits_per_color'])
+    if header['color_order'] != 0 and header['bits_per_pixel'] != header['bits_per_color']:
+        raise Exception("only chunky pixels are supported")
+    return header
+
+def _lines(fp, header, compressed):
+    # Raw lines of one page
+    size = header['bytes_per_line']
+    if not compressed:
+        for _ in range(header['height']):
+            line = fp.read(size)
+            if len(line) < size:
+                raise Exception("page ends early")
+            yield line
+        return
+    # PackBits like runs of whole pixels after a line repeat count, 128 fills with white
+    unit = max(header['bits_per_pixel'] // 8, 1)
+    white = b"\0" if header['color_space'] == _K else b"\xff"
+    read = fp.read
+    row = 0
+    while row < header['height']:
+        repeat = read(1)[0] + 1
+        line = bytearray()
+        while len(line) < size:
+            n = read(1)[0]
+            if n == 128:
+                line += white * (size - len(line))
+            elif n < 128:
+                line += read(unit) * (n + 1)
+            else:
+                line += read(unit * (257 - n))
+        line = bytes(line[:size])
+        for _ in range(min(repeat, header['height'] - row)):
+            yield line
+        row += repeat
+
+def _strips(lines, header, rows, left_offset):
+    # RGB strips of rows lines, padded with left_offset white columns
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == rows:
+            yield _rgb(b"".join(batch), len(batch), header, left_offset)
+            batch = []
+    if batch:
+        yield _rgb(b"".join(batch), len(batch), header, left_offset)
+
+def _rgb(data, count, header, left_offset):
+    import numpy as np
+    width = header['width']
+    space = header['color_space']
+    lines = np.frombuffer(data, np.uint8).reshape(count, header['bytes_per_line'])
+    if header['bits_per_color'] == 1:
+        pixels = np.unpackbits(lines, axis=1)[:, :width] * np.uint8(255)
+    elif space in (_W, _K, _SW):
+        pixels = lines[:, :width]
+    else:
+        pixels = lines[:, :width*3].reshape(count, width, 3)
+    if space == _K:
+        pixels = 255 - pixels
+    if pixels.ndim == 2:
+        pixels = np.repeat(pixels[..., None], 3, axis=2)
+    return np.pad(pixels, ((0, 0), (left_offset, 0), (0, 0)), constant_values=255)
+
+def convert(fp, out, options):
+    # Writes the ESC/P of every page of the raster stream fp to out, returns the number of pages
+    sync = fp.read(4)
+    if not sync:
+        return 0
+    if sync not in _SYNC:
+        raise Exception("not a CUPS or PWG raster stream")
+    order, compressed = _SYNC[sync]
+    columnFormat = None
+    pages = 0
+    while True:
+        data = fp.read(_HEADER_SIZE)
+        if not data:
+            return pages
+        if len(data) < _HEADER_SIZE:
+            raise Exception("page header ends early")
+        header = _header(data, order)
+        if columnFormat is None:
+            import columnFormat
+            out.write(columnFormat._printer_init(options['printer'], options['paper-width']))
+        rows = options['strip-bands'] * options['overscan'] * columnFormat._mode_width(options['mode']) * 8
+        lines = _lines(fp, header, compressed)
+        if header['height']:
+            stream = columnFormat._iter_strip_format(_strips(lines, header, rows, options['left-offset']), header['height'],
+                    **{name: options[name] for name in ('printer', 'colour', 'mode', 'overscan', 'skip',
+                        'cut', 'elide', 'trim', 'raster', 'schedule', 'dither')})
+            def write(chunk):
+                out.write(chunk)
+                out.flush()
+            columnFormat._write_stream(stream, write)
+        pages += 1
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (6, 7):
+        sys.exit("usage: rastertoescp job-id user title copies options [file]")
+    try:
+        options = _options(sys.argv[5])
+        fp = open(sys.argv[6], 'rb') if len(sys.argv) == 7 else sys.stdin.buffer
+        with fp:
+            pages = convert(fp, sys.stdout.buffer, options)
+        print("INFO: %d pages" % pages, file=sys.stderr)
+    except Exception as e:
+        print("ERROR: %s" % e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Glyph extractor for printer ROM dumps.
+
+The layout of a ROM font is described in fonts.json: the dump file and
+base offset, the cell size, bytes per dot column and their bit order,
+optional header bytes per glyph and runs of glyphs stored back to back,
+each with its offset, column count and characters. A whole font is
+decoded with array operations and written as one font file that load()
+memory-maps:
+
+    magic, count, height, width ("<8sIHH")
+    count code points (uint32)
+    count x height x width ink bytes (1 = black)
+
+A character listed twice takes the glyph of its last occurrence.
+"""
+
+from PIL import Image
+import numpy as np
+import struct
+import json
+import glob
+import os
+
+TABLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts.json')
+
+MAGIC = b"ESCPFONT"
+_HEADER = "<8sIHH"
+
+def layout(name, tables=TABLES):
+    with open(tables) as fp:
+        return json.load(fp)[name]
+
+def _decode(data, layout, run):
+    # Ink of the glyphs of one run as (glyphs, height, width)
+    columns = run.get('columns', layout.get('columns'))
+    column_bytes = layout['column_bytes']
+    header_bytes = layout.get('header_bytes', 0)
+    stride = header_bytes + columns*column_bytes
+    count = len(run['chars'])
+    start = layout.get('base', 0) + run['offset']
+    glyphs = np.frombuffer(data, np.uint8, count*stride, start).reshape(count, stride)
+    # dot rows of every column, top first
+    dots = np.unpackbits(glyphs[:, header_bytes:].reshape(count, columns, column_bytes), axis=2,
+            bitorder='big' if layout['bit_order'] == 'msb' else 'little').astype(bool)
+    if layout.get('suppress_adjacent'):
+        # the head can not fire a pin in two adjacent columns, the second dot is not printed
+        for x in range(1, columns):
+            dots[:, x] &= ~dots[:, x-1]
+    ink = np.zeros((count, layout['height'], layout['width']), bool)
+    rows = min(dots.shape[2], layout['height'])
+    top = layout.get('top')
+    if top:
+        # glyphs with the flag in their first header byte start on another row
+        flagged = glyphs[:, 0] & top['flag'] != 0
+        for mask, y in ((flagged, top['set']), (~flagged, top['clear'])):
+            ink[mask, y:y+rows, :columns] = dots[mask, :, :rows].transpose(0, 2, 1)[:, :layout['height']-y]
+    else:
+        ink[:, :rows, :columns] = dots[:, :, :rows].transpose(0, 2, 1)
+    return ink
+
+def extract(layout, directory=None):
+    # dict of the ink of every character of the font in layout, the dump file is
+    # looked up in directory (default the directory of the tables)
+    with open(os.path.join(directory or os.path.dirname(TABLES), layout['file']), 'rb') as fp:
+        data = fp.read()
+    font = {}
+    for run in layout['runs']:
+        font.update(zip(run['chars'], _decode(data, layout, run)))
+    return font
+
+def save(font, path):
+    chars = list(font)
+    ink = np.stack([font[char] for char in chars])
+    with open(path, 'wb') as fp:
+        fp.write(struct.pack(_HEADER, MAGIC, len(chars), *ink.shape[1:]))
+        fp.write(np.array([ord(char) for char in chars], '<u4').tobytes())
+        fp.write(ink.astype(np.uint8).tobytes())
+
+def load(path):
+    # Glyphs as an (n, height, width) bool array mapped from the font file, and a dict of
+    # their index by character
+    with open(path, 'rb') as fp:
+        magic, count, height, width = struct.unpack(_HEADER, fp.read(struct.calcsize(_HEADER)))
+    if magic != MAGIC:
+        raise Exception("%s is not a font file" % path)
+    offset = struct.calcsize(_HEADER)
+    codes = np.memmap(path, '<u4', 'r', offset, (count,))
+    glyphs = np.memmap(path, bool, 'r', offset + 4*count, (count, height, width))
+    return glyphs, {chr(code): i for i, code in enumerate(codes)}
+
+def write_png(font, directory):
+    # One PNG per glyph as fontrenderer used to read them, directory is emptied first
+    os.makedirs(directory, exist_ok=True)
+    for f in glob.glob(os.path.join(directory, '*')):
+        os.remove(f)
+    for char, ink in font.items():
+        Image.fromarray(~ink).save(directory + "/" + char + ".png", "PNG")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Extract a printer ROM font.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('font',
+                    help='font name in the layout tables, e.g. out24 or out9')
+    parser.add_argument('output',
+                    help='font file to write (PNG directory with --png)')
+    parser.add_argument('-t', '--tables', default=TABLES,
+                    help='JSON glyph layout tables')
+    parser.add_argument('-d', '--dump-dir',
+                    help='directory of the ROM dumps (defaults to that of the tables)')
+    parser.add_argument('--png', action="store_true",
+                    help='write a PNG per glyph instead of a font file')
+    args = parser.parse_args()
+
+    font = extract(layout(args.font, args.tables), args.dump_dir or os.path.dirname(os.path.abspath(args.tables)))
+    if args.png:
+        write_png(font, args.output)
+    else:
+        save(font, args.output)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Print spooler for columnFormat jobs.
+
+The server accepts jobs on a local Unix socket and keeps a queue per
+device. Jobs are encoded ahead of the printer in a process pool, a
+bounded number per device, and written to the device in chunks so a
+slow printer holds back its own queue only. When a device queue is
+full, submitting waits until there is room again. Any file or FIFO can
+be used as device.
+
+Requests and replies are single JSON lines:
+    {"op": "submit", "device": "lp0", "input": "/path/label.png", "options": {...}}
+    {"op": "status"} or {"op": "status", "job": 3}
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import columnFormat
+import asyncio
+import json
+import sys
+import os
+
+CHUNK = 4096
+
+def _encode(input, left_offset, options, paper_width, count):
+    # the encoder stays in the worker process for the next jobs with these options
+    encoder = columnFormat._encoder(paper_width=paper_width, **options)
+    im = columnFormat._open_image(input, left_offset)
+    blob, lines = encoder.encode(im)
+    return encoder.init + blob * count
+
+class Spooler:
+    def __init__(self, devices, jobs=None, queue=16, ahead=2):
+        self.pool = ProcessPoolExecutor(jobs)
+        self.jobs = {}
+        self.devices = devices
+        self.queues = {}
+        self.ready = {}
+        self.queue_size = queue
+        self.ahead = ahead
+        # error of every device that can not be written to
+        self.failed = {}
+        # encoder and writer tasks, kept so that they are not collected and their errors are seen
+        self.tasks = []
+
+    async def start(self):
+        for name, path in self.devices.items():
+            self.queues[name] = asyncio.Queue(self.queue_size)
+            # encoded jobs waiting for the device, encoding runs at most ahead jobs in front
+            self.ready[name] = asyncio.Queue(self.ahead)
+            for coro in (self._encoder(name), self._writer(name, path)):
+                task = asyncio.create_task(coro)
+                task.add_done_callback(self._task_done)
+                self.tasks.append(task)
+
+    def _task_done(self, task):
+        # the tasks run for ever, one that ends has failed
+        if not task.cancelled() and task.exception():
+            print("spooler task failed: %r" % task.exception(), file=sys.stderr)
+
+    def _fail(self, device, error):
+        # The device can not be written to: its queued and encoded jobs fail, and so do new ones
+        print("device %s failed: %s" % (device, error), file=sys.stderr)
+        self.failed[device] = str(error)
+        for job in self.jobs.values():
+            if job['device'] == device and job['state'] in ('queued', 'encoded'):
+                job['state'] = 'failed'
+                job['error'] = self.failed[device]
+        # let the encoder put its jobs, they are dropped there
+        while not self.ready[device].empty():
+            self.ready[device].get_nowait()
+
+    async def submit(self, request):
+        device = request['device']
+        if device not in self.queues:
+            raise Exception('not known device %s' % device)
+        if device in self.failed:
+            raise Exception('device %s failed: %s' % (device, self.failed[device]))
+        job = {'job': len(self.jobs) + 1,
+                'device': device,
+                'input': request['input'],
+                'state': 'queued',
+                'bytes': 0,
+                'written': 0}
+        self.jobs[job['job']] = job
+        # waits while the device queue is full
+        await self.queues[device].put((job, request))
+        if device in self.failed:
+            raise Exception('device %s failed: %s' % (device, self.failed[device]))
+        return job
+
+    async def _encoder(self, device):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, request = await self.queues[device].get()
+            if device in self.failed:
+                job['state'] = 'failed'
+                job['error'] = self.failed[device]
+                continue
+            job['state'] = 'encoding'
+            try:
+                data = await loop.run_in_executor(self.pool, _encode,
+                        request['input'],
+                        request.get('left_offset', 0),
+                        request['options'],
+                        request.get('paper_width', 0),
+                        request.get('count', 1))
+            except Exception as e:
+                job['state'] = 'failed'
+                job['error'] = str(e)
+                continue
+            job['bytes'] = len(data)
+            if device in self.failed:
+                job['state'] = 'failed'
+                job['error'] = self.failed[device]
+                continue
+            job['state'] = 'encoded'
+            await self.ready[device].put((job, data))
+
+    async def _writer(self, device, path):
+        loop = asyncio.get_running_loop()
+        try:
+            # opening a FIFO blocks until there is a reader
+            fd = await loop.run_in_executor(None, os.open, path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        except OSError as e:
+            self._fail(device, e)
+            return
+        while True:
+            job, data = await self.ready[device].get()
+            job['state'] = 'printing'
+            try:
+                view = memoryview(data)
+                while job['written'] < len(data):
+                    # blocking write in a thread, a slow device slows only this loop
+                    job['written'] += await loop.run_in_executor(None, os.write, fd,
+                            view[job['written']:job['written']+CHUNK])
+                job['state'] = 'done'
+            except OSError as e:
+                job['state'] = 'failed'
+                job['error'] = str(e)
+
+    async def handle(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            if request['op'] == 'submit':
+                reply = await self.submit(request)
+            elif request['op'] == 'status':
+                if 'job' in request:
+                    reply = self.jobs[request['job']]
+                else:
+                    reply = {'jobs': list(self.jobs.values())}
+            else:
+                raise Exception('not known op %s' % request['op'])
+        except Exception as e:
+            reply = {'error': str(e)}
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+async def _serve(socket, spooler):
+    await spooler.start()
+    if os.path.exists(socket):
+        os.unlink(socket)
+    server = await asyncio.start_unix_server(spooler.handle, socket)
+    async with server:
+        await server.serve_forever()
+
+async def _request(socket, request):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    return reply
+
+def request(socket, request):
+    # Sends one request to a running spooler, returns the reply
+    return asyncio.run(_request(socket, request))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Spool escp print jobs to devices.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-S', '--socket', default='/tmp/png2escp.sock',
+                    help='unix socket of the spooler')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='run the spooler',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    serve.add_argument('device', nargs='+',
+                    help='name=path of a device, file or FIFO')
+    serve.add_argument('-j', '--jobs', default=os.cpu_count(), type=int,
+                    help='number of encoding processes')
+    serve.add_argument('-q', '--queue', default=16, type=int,
+                    help='jobs waiting per device before submitting blocks')
+    serve.add_argument('-a', '--ahead', default=2, type=int,
+                    help='jobs encoded ahead of the printer per device')
+
+    submit = commands.add_parser('submit', help='queue an image',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    submit.add_argument('device',
+                    help='device name')
+    submit.add_argument('input',
+                    help='input image')
+    columnFormat._add_arguments(submit)
+
+    status = commands.add_parser('status', help='show job state')
+    status.add_argument('job', nargs='?', type=int,
+                    help='job number (all jobs when omitted)')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        devices = dict(device.split('=', 1) for device in args.device)
+        asyncio.run(_serve(args.socket, Spooler(devices, args.jobs, args.queue, args.ahead)))
+    elif args.command == 'submit':
+        reply = request(args.socket, {'op': 'submit',
+                'device': args.device,
+                'input': os.path.abspath(args.input),
+                'options': columnFormat._encoding_options(args),
+                'left_offset': args.left_offset,
+                'paper_width': args.paper_width,
+                'count': args.count})
+        print(json.dumps(reply))
+    else:
+        reply = request(args.socket, {'op': 'status', 'job': args.job} if args.job else {'op': 'status'})
+        print(json.dumps(reply, indent=1))
+    if 'error' in reply:
+        sys.exit(reply['error'])
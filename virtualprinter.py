@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Virtual printer for the streams of columnFormat and fontrenderer.
+
+The command stream is parsed as it arrives and every graphics pass is
+kept with its colour, head position and paper position, so the printed
+page can be rebuilt as one bitmap per ribbon colour. Rows are in
+1/dpi inch down the paper, overscan passes and skip feeds land on the
+rows they print on. Bytes, passes, ribbon switches, feeds and cuts are
+counted and the print time is estimated as by columnFormat --stats.
+Characters are drawn in their cell from downloaded glyphs or, given the
+ROM font (--font), from its glyphs.
+
+As a command it reads a file, stdin or a FIFO (a spooler device), at
+most at the given link speed:
+
+    virtualprinter.py -p 24pin --link 11520 --png page.png job.prn
+"""
+
+from PIL import Image
+import numpy as np
+import columnFormat
+import fontrenderer
+import json
+import time
+import sys
+import os
+
+ESC = 0x1b
+GS = 0x1d
+
+# ESC K, L, Y, Z are ESC * modes 0 to 3
+_KLYZ = b"KLYZ"
+
+# Ink of ESC r colours for the composed image
+_INKS = {0: (0, 0, 0), 1: (255, 0, 255), 2: (0, 255, 255), 4: (255, 255, 0)}
+
+class VirtualPrinter:
+    def __init__(self, printer="24pin", font=None):
+        # canvas rows per inch (vdpi), ESC J / ESC 3 units per inch and pin and horizontal
+        # densities come from the printer profile, the ROM characters from the glyphs of
+        # font (a font of fontrenderer), without it only downloaded characters are drawn
+        self.printer = printer
+        self.profile = columnFormat._profile(printer)
+        self.dpi, self.unit = self.profile['vdpi'], self.profile['unit']
+        self.spacing_unit = self.profile.get('spacing_unit', self.unit)
+        self.font = fontrenderer.atlas(font) if font else None
+        self.stats = columnFormat._Stats()
+        self.buffer = bytearray()
+        # (colour, row, column, horizontal dpi, row pitch, dots as pins x columns)
+        self.passes = []
+        self.mode = None
+        self.y = 0
+        self.bytes = 0
+        self.feeds = 0
+        self.cuts = 0
+        self.characters = 0
+        # ESC r and ESC $ bytes before the next pass and whether the last command was a
+        # pass, their bytes count to the pass as in columnFormat --stats
+        self.framing = 0
+        self.after_pass = False
+        self.reset()
+
+    def reset(self):
+        # ESC @
+        self.colour = 0
+        # head position in 1/3600 inch, a multiple of all horizontal densities
+        self.x = 0
+        self.spacing = self.dpi // 6
+        # ESC % character set and the glyphs of ESC & by code
+        self.charset = 0
+        self.downloads = {}
+
+    def write(self, data):
+        # Parses the complete commands of data, a command cut short waits for the next write
+        self.buffer += data
+        self.bytes += len(data)
+        pos = 0
+        while pos < len(self.buffer):
+            end = self._command(pos)
+            if end is None:
+                break
+            pos = end
+        del self.buffer[:pos]
+        return len(data)
+
+    def close(self):
+        if self.buffer:
+            raise Exception('stream ends inside a command')
+
+    def _command(self, pos):
+        # End of the command at pos after running it, None when it is not complete yet
+        buf = self.buffer
+        def have(n):
+            return pos + n <= len(buf)
+        b = buf[pos]
+        after_pass, self.after_pass = self.after_pass, False
+        if b == GS:
+            # GS ( E pL pH setup of escpos printers
+            if not have(5):
+                return None
+            if buf[pos+1:pos+3] != b"(E":
+                raise Exception('not known command GS %r' % bytes(buf[pos+1:pos+3]))
+            n = buf[pos+3] | buf[pos+4] << 8
+            return pos + 5 + n if have(5 + n) else None
+        if b != ESC:
+            if b == 0x0d:
+                self.x = 0
+                if after_pass:
+                    col, start, columns, size = self.stats.passes[-1]
+                    self.stats.passes[-1] = (col, start, columns, size + 1)
+            elif b == 0x0a:
+                self._feed(self.spacing)
+                self.x = 0
+            elif b == 0x0c:
+                self.feeds += 1
+            elif b >= 0x20:
+                # character at 10 cpi
+                self.characters += 1
+                self._character(b)
+                self.x += 360
+            return pos + 1
+
+        if not have(2):
+            return None
+        c = bytes(buf[pos+1:pos+2])
+        if c == b"@":
+            self.reset()
+            return pos + 2
+        if c in b"PMgi":
+            if c == b"i":
+                self.cuts += 1
+            return pos + 2
+        if c in (b"l", b"Q", b"U", b"x", b"%", b"r", b"3", b"J", b"+"):
+            if not have(3):
+                return None
+            n = buf[pos+2]
+            if c == b"r":
+                self.colour = n
+                self.framing += 3
+            elif c == b"3":
+                self.spacing = n * self.dpi // self.spacing_unit
+            elif c == b"%":
+                self.charset = n
+            elif c == b"+":
+                self.spacing = n * self.dpi // 360
+            elif c == b"J":
+                self._feed(n * self.dpi // self.unit)
+            return pos + 3
+        if c == b"$":
+            if not have(4):
+                return None
+            self.x = (buf[pos+2] | buf[pos+3] << 8) * 60
+            self.framing += 4
+            return pos + 4
+        if c == b":":
+            return pos + 5 if have(5) else None
+        if c == b"(":
+            if not have(5):
+                return None
+            n = buf[pos+3] | buf[pos+4] << 8
+            return pos + 5 + n if have(5 + n) else None
+        if c == b"*":
+            if not have(5):
+                return None
+            mode, columns = buf[pos+2], buf[pos+3] | buf[pos+4] << 8
+            width = columnFormat._mode_width(mode)
+            end = pos + 5 + columns*width
+            if not have(end - pos):
+                return None
+            if mode not in self.profile['hdpi'] or width not in self.profile['pins']:
+                raise Exception('not known graphics mode %d' % mode)
+            self.mode = mode
+            dots = np.unpackbits(np.frombuffer(buf, np.uint8, columns*width, pos + 5).reshape(columns, width), axis=1).T
+            self._pass(dots, self.profile['hdpi'][mode], self.dpi // self.profile['pins'][width], end - pos)
+            return end
+        if c in _KLYZ:
+            if not have(4):
+                return None
+            columns = buf[pos+2] | buf[pos+3] << 8
+            end = pos + 4 + columns
+            if not have(end - pos):
+                return None
+            self.mode = _KLYZ.index(c)
+            if self.mode not in self.profile['hdpi'] or 1 not in self.profile['pins']:
+                raise Exception('not known graphics mode %d' % self.mode)
+            dots = np.unpackbits(np.frombuffer(buf, np.uint8, columns, pos + 4)[:, None], axis=1).T
+            self._pass(dots, self.profile['hdpi'][self.mode], self.dpi // self.profile['pins'][1], end - pos)
+            return end
+        if c == b"^":
+            # 9 dot graphics, two bytes per column with the 9th dot in bit 7 of the second
+            if not have(5):
+                return None
+            m, columns = buf[pos+2], buf[pos+3] | buf[pos+4] << 8
+            end = pos + 5 + 2*columns
+            if not have(end - pos):
+                return None
+            dots = np.unpackbits(np.frombuffer(buf, np.uint8, 2*columns, pos + 5).reshape(columns, 2), axis=1).T[:9]
+            self._pass(dots, 120 if m else 60, self.dpi // 72, end - pos)
+            return end
+        if c == b".":
+            return self._raster(pos)
+        if c == b"&":
+            return self._download(pos)
+        raise Exception('not known command ESC %r' % c)
+
+    def _raster(self, pos):
+        # ESC . c v h m nL nH, rows of dots left to right, c = 1 run length compressed
+        buf = self.buffer
+        if pos + 8 > len(buf):
+            return None
+        compression, v, h, rows = buf[pos+2:pos+6]
+        columns = buf[pos+6] | buf[pos+7] << 8
+        size = rows * ((columns + 7) // 8)
+        start = end = pos + 8
+        if compression == 0:
+            end += size
+            if end > len(buf):
+                return None
+            data = bytes(buf[start:end])
+        elif compression == 1:
+            data = bytearray()
+            while len(data) < size:
+                if end >= len(buf):
+                    return None
+                n = buf[end]
+                if n < 128:
+                    if end + n + 2 > len(buf):
+                        return None
+                    data += buf[end+1:end+n+2]
+                    end += n + 2
+                else:
+                    if end + 2 > len(buf):
+                        return None
+                    data += bytes(buf[end+1:end+2]) * (257 - n)
+                    end += 2
+        else:
+            raise Exception('not known raster compression %d' % compression)
+        dots = np.unpackbits(np.frombuffer(bytes(data[:size]), np.uint8).reshape(rows, -1), axis=1)[:, :columns]
+        hdpi = 3600 // h
+        self.mode = min((m for m, dpi in self.profile['hdpi'].items() if dpi == hdpi and m & 32), default=self.mode)
+        self._pass(dots, hdpi, self.dpi * v // 3600, end - pos)
+        return end
+
+    def _download(self, pos):
+        # ESC & NUL n m, the glyphs of codes n to m are kept for ESC % 1
+        buf = self.buffer
+        if pos + 5 > len(buf):
+            return None
+        end = pos + 5
+        # characters of 24 dot cells start with space, columns, space, 9 dot ones are an
+        # attribute (bit 7 for the upper 8 of the 9 rows) and 11 columns
+        height, width = self.profile.get('cell', (9, 11))
+        glyphs = {}
+        for code in range(buf[pos+3], buf[pos+4] + 1):
+            ink = np.zeros((height, width), bool)
+            if height > 9:
+                if end + 3 > len(buf):
+                    return None
+                left, columns = buf[end], buf[end+1]
+                if end + 3 + 3*columns > len(buf):
+                    return None
+                data = np.frombuffer(buf, np.uint8, 3*columns, end + 3).reshape(columns, 3)
+                ink[:, left:left+columns] = np.unpackbits(data, axis=1).T[:, :width-left]
+                end += 3 + 3*columns
+            else:
+                if end + 12 > len(buf):
+                    return None
+                top = 0 if buf[end] & 0x80 else 1
+                data = np.frombuffer(buf, np.uint8, 11, end + 1)
+                ink[top:top+8] = np.unpackbits(data[:, None], axis=1).T[:, :width]
+                end += 12
+            glyphs[code] = ink
+        self.downloads.update(glyphs)
+        return end
+
+    def _character(self, code):
+        # Draws the glyph of code at the head, ESC % 1 takes downloaded glyphs before the
+        # ROM ones (ESC : copied them)
+        ink = self.downloads.get(code) if self.charset else None
+        if ink is None and self.font:
+            glyphs, index = self.font
+            if chr(code) in index:
+                ink = np.asarray(glyphs[index[chr(code)]])
+        if ink is None or not ink.any():
+            return
+        # cells are 1/10 inch of 120 dpi columns, rows are the pins of the cell
+        pins = self.profile['pins'][len(ink) // 8]
+        self.passes.append((self.colour, self.y, self.x * 120 // 3600, 120, self.dpi // pins, ink))
+
+    def _pass(self, dots, hdpi, pitch, size):
+        column = self.x * hdpi // 3600
+        self.passes.append((self.colour, self.y, column, hdpi, pitch, dots))
+        self.stats.add_pass(self.colour, column, dots.shape[1], size + self.framing)
+        self.framing = 0
+        self.after_pass = True
+        self.x += dots.shape[1] * 3600 // hdpi
+
+    def _feed(self, rows):
+        self.y += rows
+        self.feeds += 1
+
+    def colours(self):
+        return sorted({p[0] for p in self.passes})
+
+    def bitmap(self, colour=0):
+        # Printed dots of one colour, rows in 1/dpi inch down the paper and columns in dots
+        # of the graphics mode. Bitmaps of all colours have the same size.
+        if len({p[3] for p in self.passes}) > 1:
+            raise Exception('passes of several horizontal densities')
+        height = max((y + (len(dots) - 1)*pitch + 1 for _, y, x, _, pitch, dots in self.passes), default=0)
+        width = max((x + dots.shape[1] for _, y, x, _, pitch, dots in self.passes), default=0)
+        canvas = np.zeros((height, width), bool)
+        for col, y, x, _, pitch, dots in self.passes:
+            if col == colour:
+                canvas[y:y + len(dots)*pitch:pitch, x:x + dots.shape[1]] |= dots.astype(bool)
+        return canvas
+
+    def image(self):
+        # The page as RGB, colours printed over each other
+        page = None
+        for colour in self.colours():
+            dots = self.bitmap(colour)
+            if page is None:
+                page = np.full(dots.shape + (3,), 255, np.uint16)
+            page[dots] = page[dots] * _INKS.get(colour, (0, 0, 0)) // 255
+        if page is None:
+            return Image.new("RGB", (1, 1), '#fff')
+        return Image.fromarray(page.astype(np.uint8), "RGB")
+
+    def report(self, link=0):
+        # Counts and print time estimate of everything written so far
+        self.stats.counts['output'] = self.bytes
+        lines = self.y * self.unit // self.dpi
+        report = columnFormat._report(self.stats, self.printer, self.mode, lines, 1, link)
+        del report['stages']
+        report.update(feeds=self.feeds, cuts=self.cuts, characters=self.characters)
+        return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Parse an escp stream and render the printed page.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', default='-', nargs='?',
+                    help='printer stream, file or FIFO (defaults to stdin)')
+    parser.add_argument('-p', '--printer', default='9pin',
+                    help='printer type, a profile of %s (%s)' % (os.path.basename(columnFormat.PROFILES), ", ".join(columnFormat._profiles())))
+    parser.add_argument('--link', default=0, type=int,
+                    help='read at most that many bytes per second, as a printer on a slow link')
+    parser.add_argument('--png',
+                    help='write the printed page to this image')
+    parser.add_argument('-f', '--font',
+                    help='ROM font of character mode, font directory or file of romfont.py')
+    parser.add_argument('--stats', default='-',
+                    help='write counts and print time estimate as JSON to file (- for stderr)')
+    args = parser.parse_args()
+
+    printer = VirtualPrinter(args.printer, args.font)
+    start = time.perf_counter()
+    with (sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')) as fp:
+        while True:
+            data = fp.read(max(args.link // 10, 1) if args.link else 1 << 16)
+            if not data:
+                break
+            printer.write(data)
+            if args.link:
+                # hold back until the link would have sent it
+                time.sleep(max(printer.bytes / args.link - (time.perf_counter() - start), 0))
+    printer.close()
+
+    report = printer.report(args.link)
+    report['elapsed'] = time.perf_counter() - start
+    if args.png:
+        printer.image().save(args.png)
+    with (sys.stderr if args.stats == '-' else open(args.stats, 'w')) as out:
+        json.dump(report, out, indent=1)
+        out.write("\n")